@@ -0,0 +1,130 @@
+"""
+摄像头预览画面广播，每一帧在每个分辨率下只缩放、编码一次，所有订阅者共享同一份JPEG数据
+"""
+
+import time
+import asyncio
+import threading
+from collections import defaultdict
+from typing import Dict, Optional, Set, Tuple
+
+import cv2
+import numpy as np
+
+
+def resize_to_height(frame: np.ndarray, height: Optional[int]) -> np.ndarray:
+    oh, ow = frame.shape[:2]
+    if not height or oh == height:
+        return frame
+    scale = height / oh
+    return cv2.resize(frame, (int(ow * scale), int(height)))
+
+
+def encode_jpeg(frame: np.ndarray, height: Optional[int]) -> bytes:
+    ret, buf = cv2.imencode(".jpg", resize_to_height(frame, height))
+    if not ret:
+        raise ValueError("图像编码失败！")
+    return buf.tobytes()
+
+
+class FrameBroadcaster:
+    """
+    单个摄像头的预览广播
+
+    发布端只保存最新一帧并通知等待中的订阅者，订阅者按自己的节奏取最新帧，
+    慢的订阅者只会跳帧，不会阻塞其他订阅者
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.subscribers = 0
+        self._next_publish_ts = 0.0
+        self._frame: Optional[np.ndarray] = None
+        self._seq = 0
+        # 等待新帧的订阅者, 发布线程通过 call_soon_threadsafe 唤醒
+        self._waiters: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+        # 当前帧各分辨率下已编码的数据, key 为 camera_height
+        self._encoded: Dict[Optional[int], bytes] = {}
+        # 同一分辨率同一时刻只允许一个订阅者编码，其余等待复用结果
+        self._encode_locks: Dict[Optional[int], threading.Lock] = defaultdict(
+            threading.Lock
+        )
+
+    def subscribe(self) -> None:
+        with self._lock:
+            self.subscribers += 1
+
+    def unsubscribe(self) -> None:
+        with self._lock:
+            self.subscribers -= 1
+            if not self.subscribers:
+                # 没有订阅者时释放最后一帧
+                self._frame = None
+                self._encoded = {}
+
+    def wants_frame(self, fps: float) -> bool:
+        """有订阅者且距上次发布已超过预览帧间隔时才需要发布"""
+        if not self.subscribers:
+            return False
+        now = time.time()
+        with self._lock:
+            if now < self._next_publish_ts:
+                return False
+            self._next_publish_ts = now + 1 / fps
+        return True
+
+    def publish(self, frame: np.ndarray) -> None:
+        with self._lock:
+            self._frame = frame
+            self._seq += 1
+            self._encoded = {}
+            waiters, self._waiters = self._waiters, set()
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def _encode(self, seq: int, frame: np.ndarray, height: Optional[int]) -> bytes:
+        with self._encode_locks[height]:
+            with self._lock:
+                data = self._encoded.get(height) if seq == self._seq else None
+            if data is None:
+                data = encode_jpeg(frame, height)
+                with self._lock:
+                    if seq == self._seq:
+                        self._encoded[height] = data
+        return data
+
+    async def get(
+        self, height: Optional[int], last_seq: int, timeout: float = 1.0
+    ) -> Tuple[int, Optional[bytes]]:
+        """
+        等待并获取比 last_seq 更新的一帧JPEG数据
+
+        :param height: 预览分辨率高度, None 表示原图
+        :param last_seq: 订阅者上一次拿到的帧序号
+        :param timeout: 等待新帧的超时时间
+        :return: (帧序号, JPEG数据)，超时未有新帧时数据为 None
+        """
+        loop = asyncio.get_running_loop()
+        waiter = None
+        with self._lock:
+            if self._seq == last_seq:
+                waiter = (loop, asyncio.Event())
+                self._waiters.add(waiter)
+        if waiter:
+            try:
+                await asyncio.wait_for(waiter[1].wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                with self._lock:
+                    self._waiters.discard(waiter)
+
+        with self._lock:
+            if self._seq == last_seq or self._frame is None:
+                return last_seq, None
+            seq, frame = self._seq, self._frame
+            data = self._encoded.get(height)
+        if data is None:
+            # 缩放编码放到线程池，避免阻塞事件循环
+            data = await loop.run_in_executor(None, self._encode, seq, frame, height)
+        return seq, data
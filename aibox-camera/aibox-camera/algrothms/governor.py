@@ -0,0 +1,59 @@
+"""
+摄像头帧率控制，在源头按目标帧率均匀抽帧
+"""
+
+import time
+from typing import List, Optional
+
+
+class FpsGovernor:
+    """按目标帧率均匀抽帧, target_fps 为空时不限制"""
+
+    def __init__(self, target_fps: Optional[float] = None) -> None:
+        self.target_fps = target_fps
+        self.passed_frames = 0
+        self.skipped_frames = 0
+        self._next_ts: Optional[float] = None
+
+    def allow(self, now: float = None) -> bool:
+        if not self.target_fps:
+            self.passed_frames += 1
+            return True
+
+        now = now or time.time()
+        interval = 1 / self.target_fps
+        if self._next_ts is not None and now < self._next_ts:
+            self.skipped_frames += 1
+            return False
+
+        # 按固定间隔推进下一帧时间，落后超过一个间隔时重新对齐，避免突发补帧
+        if self._next_ts is None or now - self._next_ts > interval:
+            self._next_ts = now + interval
+        else:
+            self._next_ts += interval
+        self.passed_frames += 1
+        return True
+
+
+def allocate_fps(
+    targets: List[Optional[float]], budget: Optional[float] = None
+) -> List[Optional[float]]:
+    """
+    将总帧率预算按最大最小公平原则分配到各摄像头
+
+    :param targets: 各摄像头的目标帧率, 为空表示不限制
+    :param budget: 所有摄像头的总帧率上限, 为空表示不限制
+    :return: 各摄像头实际使用的目标帧率
+    """
+    if not budget or not targets:
+        return list(targets)
+
+    # 需求小的摄像头先分配，剩余预算由其余摄像头平分
+    order = sorted(range(len(targets)), key=lambda i: targets[i] or float("inf"))
+    allocated: List[Optional[float]] = [None] * len(targets)
+    remaining = budget
+    for k, idx in enumerate(order):
+        share = remaining / (len(targets) - k)
+        allocated[idx] = min(targets[idx] or float("inf"), share)
+        remaining -= allocated[idx]
+    return allocated
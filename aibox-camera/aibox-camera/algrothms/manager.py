@@ -0,0 +1,197 @@
+"""
+摄像头采集管理，支持运行时增删摄像头
+"""
+
+import threading
+from collections import defaultdict
+from functools import partial
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from .governor import FpsGovernor, allocate_fps
+from .scheduler import ConversionPool
+from .streamer import VideoStreamer
+
+
+class CameraManager:
+    """
+    管理所有摄像头的采集实例
+
+    coral 的并行 worker 不再与摄像头一一绑定，每个摄像头固定分配给一个 worker，
+    worker 在自己负责的摄像头中轮询取帧。同一摄像头始终由同一个 worker 串行读取，
+    保证采集缓存的回收时机不变
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        resolution: str,
+        max_total_fps: Optional[float] = None,
+        convert_workers: int = 0,
+        capture_cores: Optional[List[int]] = None,
+    ) -> None:
+        self.workers = max(workers, 1)
+        self.resolution = resolution
+        self.max_total_fps = max_total_fps
+        self.capture_cores = capture_cores or None
+        # 所有摄像头共享的颜色转换线程池
+        self.conversion_pool = (
+            ConversionPool(convert_workers, cores=self.capture_cores)
+            if convert_workers > 0
+            else None
+        )
+        # 摄像头名称 -> 上下文，web 直接读取该字典
+        self.contexts: Dict[str, dict] = {}
+        # 摄像头名称 -> worker 下标
+        self._assignment: Dict[str, int] = {}
+        self._cursors: Dict[int, int] = defaultdict(int)
+        self._ready = [threading.Event() for _ in range(self.workers)]
+        # 各 worker 轮询所有摄像头均无新帧的次数
+        self.idle_polls: Dict[int, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    @property
+    def camera_ids(self) -> List[str]:
+        return list(self.contexts.keys())
+
+    def _notify(self, name: str) -> None:
+        worker = self._assignment.get(name)
+        if worker is not None:
+            self._ready[worker].set()
+
+    def _least_loaded_worker(self) -> int:
+        loads = [0] * self.workers
+        for worker in self._assignment.values():
+            loads[worker] += 1
+        return loads.index(min(loads))
+
+    def _rebalance_fps(self) -> None:
+        names = list(self.contexts.keys())
+        fps = allocate_fps(
+            [self.contexts[name]["target_fps"] for name in names], self.max_total_fps
+        )
+        for name, target_fps in zip(names, fps):
+            self.contexts[name]["governor"].target_fps = target_fps
+
+    def add(self, camera: dict, worker: Optional[int] = None) -> dict:
+        """
+        启动摄像头采集
+
+        :param camera: CameraParamsModel 的字典数据
+        :param worker: 指定负责的 worker, 为空时分配给负载最小的 worker
+        :return: 摄像头上下文
+        """
+        name = camera["name"]
+        if name in self.contexts:
+            raise ValueError(f"相机名称需要保持唯一, 已存在相机 {name}")
+
+        # 打开摄像头可能耗时较长，放在锁外
+        vc = VideoStreamer(
+            camera["url"],
+            wait=0,
+            on_frame=partial(self._notify, name),
+            pool=self.conversion_pool,
+            cores=self.capture_cores,
+        )
+        context = {
+            **camera,
+            "vc": vc,
+            "governor": FpsGovernor(),
+            "resolution": self.resolution,
+        }
+        with self._lock:
+            if worker is None:
+                worker = self._least_loaded_worker()
+            self._assignment[name] = worker % self.workers
+            self.contexts[name] = context
+            self._rebalance_fps()
+        logger.info(
+            f"camera {name} started on worker {worker}, "
+            f"target fps: {context['governor'].target_fps}"
+        )
+        return context
+
+    def remove(self, name: str) -> None:
+        with self._lock:
+            context = self.contexts.pop(name, None)
+            self._assignment.pop(name, None)
+            self._rebalance_fps()
+        if context is None:
+            logger.warning(f"camera {name} not exists!")
+            return
+        context["vc"].release()
+        logger.info(f"camera {name} stopped")
+
+    def read(
+        self, worker: int, timeout: float = 0.1
+    ) -> Tuple[Optional[dict], Optional[np.ndarray]]:
+        """
+        从 worker 负责的摄像头中轮询读取一帧，均无新帧时等待新帧通知
+
+        :return: (摄像头上下文, 帧)，超时无新帧时均为 None
+        """
+        ready = self._ready[worker]
+        # 先清除再轮询，轮询期间到达的新帧会重新置位，不会丢失通知
+        ready.clear()
+        with self._lock:
+            names = [name for name, w in self._assignment.items() if w == worker]
+            cursor = self._cursors[worker]
+            self._cursors[worker] = cursor + 1
+        if names:
+            offset = cursor % len(names)
+            names = names[offset:] + names[:offset]
+        for name in names:
+            context = self.contexts.get(name)
+            # 重连中的摄像头直接跳过，不影响其他摄像头
+            if context is None or not context["vc"].is_running():
+                continue
+            ret, frame = context["vc"].read()
+            if ret:
+                return context, frame
+
+        self.idle_polls[worker] += 1
+        ready.wait(timeout)
+        return None, None
+
+    def stats(self, name: str) -> dict:
+        """单个摄像头的采集统计"""
+        context = self.contexts[name]
+        governor: FpsGovernor = context["governor"]
+        return {
+            "worker": self._assignment.get(name),
+            "state": context["vc"].state,
+            "target_fps": governor.target_fps,
+            "passed_frames": governor.passed_frames,
+            "skipped_frames": governor.skipped_frames,
+            "queue_depth": context["vc"].queue_depth(),
+            **context["vc"].stats.to_dict(),
+        }
+
+    def worker_stats(self) -> dict:
+        with self._lock:
+            assignment = dict(self._assignment)
+        return {
+            worker: {
+                "cameras": [n for n, w in assignment.items() if w == worker],
+                "idle_polls": self.idle_polls[worker],
+            }
+            for worker in range(self.workers)
+        }
+
+    def conversion_stats(self) -> Optional[dict]:
+        pool = self.conversion_pool
+        if pool is None:
+            return None
+        return {
+            "workers": pool.workers,
+            "cores": pool.cores,
+            "queue_depth": pool.queue_depth(),
+        }
+
+    def release(self) -> None:
+        for name in self.camera_ids:
+            self.remove(name)
+        if self.conversion_pool is not None:
+            self.conversion_pool.close()
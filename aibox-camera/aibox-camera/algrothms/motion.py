@@ -0,0 +1,64 @@
+"""
+画面变化检测，静止画面可复用下游上一次的识别结果
+"""
+
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+
+class MotionDetector:
+    """
+    在灰度缩略图上与上一次关键帧做帧差，得到变化像素占比
+
+    参考帧只在判定为变化时更新，缓慢的变化会持续累积直到超过阈值；
+    连续未变化的帧数达到 keyframe_interval 时强制输出一次关键帧，限制结果的陈旧程度
+    """
+
+    def __init__(
+        self,
+        thumb_width: int = 64,
+        pixel_threshold: int = 20,
+        threshold: float = 0.01,
+        keyframe_interval: int = 25,
+    ) -> None:
+        self.thumb_width = thumb_width
+        self.pixel_threshold = pixel_threshold
+        self.threshold = threshold
+        self.keyframe_interval = keyframe_interval
+        self.total_frames = 0
+        self.changed_frames = 0
+        self._reference: Optional[np.ndarray] = None
+        self._frames_since_key = 0
+
+    def _thumbnail(self, frame: np.ndarray) -> np.ndarray:
+        oh, ow = frame.shape[:2]
+        size = (self.thumb_width, max(int(oh * self.thumb_width / ow), 1))
+        small = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+    def update(self, frame: np.ndarray) -> Tuple[float, bool]:
+        """
+        :param frame: BGR 画面
+        :return: (变化像素占比, 是否需要下游重新识别)
+        """
+        thumb = self._thumbnail(frame)
+        self.total_frames += 1
+        if self._reference is None or self._reference.shape != thumb.shape:
+            score, changed = 1.0, True
+        else:
+            diff = cv2.absdiff(thumb, self._reference)
+            score = float(np.count_nonzero(diff > self.pixel_threshold)) / diff.size
+            changed = (
+                score >= self.threshold
+                or self._frames_since_key + 1 >= self.keyframe_interval
+            )
+
+        if changed:
+            self._reference = thumb
+            self._frames_since_key = 0
+            self.changed_frames += 1
+        else:
+            self._frames_since_key += 1
+        return score, changed
@@ -0,0 +1,141 @@
+"""
+采集调度，所有摄像头共享固定数量的颜色转换线程，并可将采集相关线程绑定到指定CPU核心
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+import cv2
+from loguru import logger
+
+
+def pin_current_thread(cores: Optional[List[int]]) -> None:
+    """将当前线程绑定到指定CPU核心，之后由该线程创建的线程继承相同的绑定"""
+    if not cores or not hasattr(os, "sched_setaffinity"):
+        return
+    try:
+        os.sched_setaffinity(0, cores)
+    except OSError as e:
+        logger.warning(f"set cpu affinity {cores} error: {e}")
+
+
+class ConversionPool:
+    """
+    多摄像头共享的转换线程池
+
+    每个摄像头最多只有一个待处理任务，新帧到达时替换尚未开始的旧任务；
+    待处理任务按摄像头先后顺序轮流执行，同一摄像头的任务不会并发执行，
+    帧率高的摄像头不会挤占其他摄像头的转换线程。
+
+    cv2.cvtColor 默认还会使用 OpenCV 自己的线程池，线程池启动时将 OpenCV 线程数设为 1，
+    使 workers 成为转换线程数的上限；该设置对整个进程的 OpenCV 调用生效
+    """
+
+    def __init__(self, workers: int = 2, cores: Optional[List[int]] = None) -> None:
+        self.workers = max(workers, 1)
+        self.cores = cores
+        self._cond = threading.Condition()
+        # key -> (任务, 任务被替换时的回调)
+        self._pending: "OrderedDict[Hashable, Tuple[Callable, Optional[Callable]]]" = (
+            OrderedDict()
+        )
+        self._active: Set[Hashable] = set()
+        self._threads: List[threading.Thread] = []
+        self._running = False
+        self._closed = False
+        # 各 key 被替换丢弃的任务数
+        self.replaced: Dict[Hashable, int] = {}
+
+    def _start(self) -> None:
+        # 首次提交任务时才启动线程，不使用转换线程池的采集方式不占用线程
+        cv2.setNumThreads(1)
+        self._running = True
+        for idx in range(self.workers):
+            thread = threading.Thread(
+                target=self._worker, name=f"capture-convert-{idx}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(
+        self, key: Hashable, func: Callable[[], None], discard: Callable = None
+    ) -> bool:
+        """
+        提交任务
+
+        :param key: 摄像头标识
+        :param func: 转换任务
+        :param discard: 任务未执行就被替换时的回调，用于回收任务占用的缓存
+        :return: 是否替换了该摄像头尚未执行的旧任务
+        """
+        with self._cond:
+            if self._closed:
+                # 已关闭时直接丢弃
+                old = (func, discard)
+            else:
+                if not self._running:
+                    self._start()
+                old = self._pending.get(key)
+                # 替换旧任务时保持其排队位置
+                self._pending[key] = (func, discard)
+                if old is not None:
+                    self.replaced[key] = self.replaced.get(key, 0) + 1
+                self._cond.notify()
+        if old is not None and old[1]:
+            old[1]()
+        return old is not None
+
+    def cancel(self, key: Hashable) -> None:
+        with self._cond:
+            old = self._pending.pop(key, None)
+            self.replaced.pop(key, None)
+        if old is not None and old[1]:
+            old[1]()
+
+    def _take(self) -> Optional[Tuple[Hashable, Callable]]:
+        for key in self._pending:
+            if key not in self._active:
+                func, _ = self._pending.pop(key)
+                self._active.add(key)
+                return key, func
+        return None
+
+    def _worker(self) -> None:
+        pin_current_thread(self.cores)
+        while True:
+            with self._cond:
+                task = self._take()
+                while task is None and self._running:
+                    self._cond.wait()
+                    task = self._take()
+                if task is None:
+                    return
+            key, func = task
+            try:
+                func()
+            except Exception as e:
+                logger.exception(f"capture convert {key} error: {e}")
+            finally:
+                with self._cond:
+                    self._active.discard(key)
+                    # 同一摄像头的下一个任务可能在等待当前任务完成
+                    self._cond.notify()
+
+    def queue_depth(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    def close(self) -> None:
+        with self._cond:
+            self._running = False
+            self._closed = True
+            pending, self._pending = self._pending, OrderedDict()
+            self._cond.notify_all()
+        for _, discard in pending.values():
+            if discard:
+                discard()
+        for thread in self._threads:
+            thread.join(timeout=1)
+        self._threads = []
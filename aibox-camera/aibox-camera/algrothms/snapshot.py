@@ -0,0 +1,102 @@
+"""
+摄像头原图快照缓存，供绘制Mask等低频请求使用，不占用预览广播的画面
+"""
+
+import time
+import threading
+import zlib
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+from .broadcast import encode_jpeg
+
+
+class SnapshotCache:
+    """
+    单个摄像头的最新原图快照
+
+    快照只在最近有请求时按 interval 低频刷新，长时间无人请求时不再拷贝画面；
+    JPEG 数据按需编码并缓存，快照未更新时重复请求直接返回缓存
+    """
+
+    # 缓存的叠加Mask结果数量，编辑Mask时通常只有少数几组坐标来回切换
+    max_encoded = 8
+
+    def __init__(self, interval: float = 1.0, idle_timeout: float = 60.0) -> None:
+        # 快照刷新间隔
+        self.interval = interval
+        # 超过该时间没有请求则停止刷新
+        self.idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        self._updated = threading.Condition(self._lock)
+        self._frame: Optional[np.ndarray] = None
+        self.seq = 0
+        self.timestamp: Optional[float] = None
+        self._last_access = 0.0
+        # 当前快照已编码的数据, key 为叠加的 Mask 坐标, value 为 (ETag, JPEG数据)
+        self._encoded: Dict[Optional[tuple], Tuple[str, bytes]] = {}
+
+    def due(self) -> bool:
+        """最近有请求且快照已过期时才需要刷新"""
+        now = time.time()
+        if now - self._last_access > self.idle_timeout:
+            return False
+        return self.timestamp is None or now - self.timestamp >= self.interval
+
+    def update(self, frame: np.ndarray) -> None:
+        with self._updated:
+            self._frame = frame
+            self.seq += 1
+            self.timestamp = time.time()
+            self._encoded = {}
+            self._updated.notify_all()
+
+    def _wait_frame(self, timeout: float) -> bool:
+        """快照不存在或已因无人请求而停止刷新时，等待 sender 刷新一帧"""
+        with self._updated:
+            now = time.time()
+            idle = now - self._last_access > self.idle_timeout
+            self._last_access = now
+            if self._frame is not None and not idle:
+                return True
+            seq = self.seq
+            return self._updated.wait_for(lambda: self.seq != seq, timeout)
+
+    def get(
+        self,
+        points: Optional[tuple] = None,
+        draw: Optional[Callable[[np.ndarray, tuple], None]] = None,
+        timeout: float = 5.0,
+    ) -> Optional[Tuple[str, float, bytes]]:
+        """
+        获取最新快照的JPEG数据
+
+        :param points: 叠加绘制的 Mask 坐标
+        :param draw: 在画面拷贝上绘制 Mask 的函数
+        :param timeout: 没有可用快照时等待刷新的超时时间
+        :return: (ETag, 快照时间, JPEG数据)，超时未获取到快照时返回 None
+        """
+        if not self._wait_frame(timeout):
+            return None
+        with self._lock:
+            seq, frame, timestamp = self.seq, self._frame, self.timestamp
+            cached = self._encoded.get(points)
+        if cached:
+            return cached[0], timestamp, cached[1]
+
+        if points and draw:
+            # 在拷贝上绘制，快照本身保持原样供其他请求复用
+            frame = frame.copy()
+            draw(frame, points)
+        data = encode_jpeg(frame, None)
+        # 摄像头重新添加后 seq 会从头计数，ETag 中同时带上快照时间
+        etag = (
+            f'"{int(timestamp * 1000):x}-{seq}-{zlib.crc32(repr(points).encode()):08x}"'
+        )
+        with self._lock:
+            if seq == self.seq:
+                if len(self._encoded) >= self.max_encoded:
+                    self._encoded.pop(next(iter(self._encoded)))
+                self._encoded[points] = (etag, data)
+        return etag, timestamp, data
@@ -0,0 +1,112 @@
+"""
+采集链路统计，用于判断处理慢是卡在采集端还是下游
+"""
+
+import bisect
+import threading
+from typing import Dict, List, Optional
+
+
+class Histogram:
+    """
+    固定分桶的耗时直方图(毫秒)，记录开销为一次二分查找，百分位数按桶上界估算
+    """
+
+    # 桶上界(毫秒), 最后一个桶记录超过 5 秒的值
+    bounds = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+    def __init__(self) -> None:
+        self.buckets: List[int] = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value_ms: float) -> None:
+        self.buckets[bisect.bisect_left(self.bounds, value_ms)] += 1
+        self.count += 1
+        self.total += value_ms
+        if value_ms > self.max:
+            self.max = value_ms
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for idx, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                # 桶上界不会超过实际最大值
+                if idx < len(self.bounds):
+                    return min(float(self.bounds[idx]), round(self.max, 3))
+                return round(self.max, 3)
+        return round(self.max, 3)
+
+    def to_dict(self) -> Dict:
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 3) if self.count else None,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+            "max": round(self.max, 3),
+            "buckets": {
+                **{f"le_{b}": n for b, n in zip(self.bounds, self.buckets)},
+                "inf": self.buckets[-1],
+            },
+        }
+
+
+class CaptureStats:
+    """
+    单个采集实例的统计
+
+    captured: 采集到的帧数
+    dropped: 未被 sender 读取就因缓存已满被丢弃的帧数
+    empty_reads: sender 读取时没有新帧的次数
+    reconnects: 断流后重连的次数
+    decode_ms: 单帧解码/转换/拷贝耗时
+    age_ms: 帧从采集完成到交给 sender 的时间
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.captured = 0
+        self.dropped = 0
+        self.empty_reads = 0
+        self.reconnects = 0
+        self.decode_ms = Histogram()
+        self.age_ms = Histogram()
+
+    def on_capture(self, decode_seconds: float, dropped: bool = False) -> None:
+        with self._lock:
+            self.captured += 1
+            if dropped:
+                self.dropped += 1
+            self.decode_ms.observe(decode_seconds * 1000)
+
+    def on_drop(self) -> None:
+        with self._lock:
+            self.dropped += 1
+
+    def on_reconnect(self) -> None:
+        with self._lock:
+            self.reconnects += 1
+
+    def on_read(self, age_seconds: Optional[float]) -> None:
+        with self._lock:
+            if age_seconds is None:
+                self.empty_reads += 1
+            else:
+                self.age_ms.observe(age_seconds * 1000)
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                "captured": self.captured,
+                "dropped": self.dropped,
+                "empty_reads": self.empty_reads,
+                "reconnects": self.reconnects,
+                "decode_ms": self.decode_ms.to_dict(),
+                "age_ms": self.age_ms.to_dict(),
+            }
@@ -1,45 +1,310 @@
 import os
+import glob
+import time
+import random
 import threading
 from collections import deque
+from functools import partial
+from typing import Callable, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
 
 import cv2
 import numpy as np
 from loguru import logger
 
+from .scheduler import ConversionPool, pin_current_thread
+from .stats import CaptureStats
+
 
 MODEL_TYPE = os.environ.get("MODEL_TYPE", "onnx")
 
 
 class VideoStreamer:
-    def __init__(self, video_idx: str) -> None:
-        if MODEL_TYPE == "rknn":
-            self.streamer = VideoAHDStreamer(video_idx)
+    def __init__(
+        self,
+        video_idx: str,
+        threaded: bool = True,
+        wait: float = 0.1,
+        on_frame: Optional[Callable[[], None]] = None,
+        pool: Optional[ConversionPool] = None,
+        cores: Optional[List[int]] = None,
+    ) -> None:
+        """
+        :param pool: 多摄像头共享的颜色转换线程池, 为空时在各自的采集管道中转换
+        :param cores: 采集线程绑定的CPU核心, 为空时不绑定
+        """
+        replay = create_replay_streamer(
+            video_idx, wait=wait, on_frame=on_frame, cores=cores
+        )
+        if replay is not None:
+            self.streamer = replay
+        elif MODEL_TYPE == "rknn":
+            self.streamer = VideoAHDStreamer(
+                video_idx, on_frame=on_frame, pool=pool, cores=cores
+            )
         else:
-            self.streamer = VideoCv2Streamer(video_idx)
+            self.streamer = VideoCv2Streamer(
+                video_idx, threaded=threaded, wait=wait, on_frame=on_frame, cores=cores
+            )
+
+    @property
+    def stats(self) -> CaptureStats:
+        return self.streamer.stats
+
+    def queue_depth(self) -> int:
+        return self.streamer.queue_depth()
+
+    @property
+    def state(self) -> str:
+        state = getattr(self.streamer, "state", None)
+        if state is None:
+            state = "running" if self.streamer.is_running() else "stopped"
+        return state
+
+    def is_running(self) -> bool:
+        return self.streamer.is_running()
 
     def read(self):
         return self.streamer.read()
 
+    def release(self):
+        self.streamer.release()
+
 
 class VideoCv2Streamer:
+    """
+    OpenCV 采集
+
+    threaded 模式下后台线程持续读取并只保留最新一帧，避免 FFmpeg 内部缓冲积压旧帧，
+    延迟不超过一个帧间隔。
+    采集线程同时负责断线重连：打开失败或超过 stall_timeout 没有新帧时释放并重新打开，
+    重连间隔按指数退避并加随机抖动，避免多路摄像头同时重连
+    """
 
-    def __init__(self, video_idx: str):
+    CONNECTING = "connecting"
+    RUNNING = "running"
+    RECONNECTING = "reconnecting"
+    STOPPED = "stopped"
+
+    def __init__(
+        self,
+        video_idx: str,
+        threaded: bool = True,
+        wait: float = 0.1,
+        on_frame: Optional[Callable[[], None]] = None,
+        stall_timeout: float = 5.0,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30.0,
+        cores: Optional[List[int]] = None,
+    ):
         if video_idx.isdigit():
             video_idx = int(video_idx)
-        self.cap = cv2.VideoCapture(video_idx)
+        self.video_idx = video_idx
 
-        if not self.cap.isOpened():
-            raise ValueError("can't open camera!")
+        self.threaded = threaded
+        # 无新帧时 read 最多等待的时间
+        self.wait = wait
+        # 新帧到达时的回调
+        self.on_frame = on_frame
+        # 超过该时间没有新帧视为断流
+        self.stall_timeout = stall_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.cores = cores
+        # 未被读取就被新帧覆盖的帧计入 dropped
+        self.stats = CaptureStats()
+        self.state = self.CONNECTING
+        # 最新一帧的采集时间
+        self.capture_ts: Optional[float] = None
+        self._frame: Optional[np.ndarray] = None
+        self._has_new = False
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.cap: Optional[cv2.VideoCapture] = None
+        if self.threaded:
+            # 由采集线程打开，摄像头暂时不可用时不影响节点启动
+            self.run()
+        else:
+            self.cap = self._open()
+            if self.cap is None:
+                raise ValueError("can't open camera!")
+            self.state = self.RUNNING
+
+    def _open(self) -> Optional[cv2.VideoCapture]:
+        params = []
+        if isinstance(self.video_idx, str):
+            # 网络摄像头限制打开及读取的阻塞时间，断网时尽快返回以便重连
+            timeout_ms = int(self.stall_timeout * 1000)
+            for prop in ("CAP_PROP_OPEN_TIMEOUT_MSEC", "CAP_PROP_READ_TIMEOUT_MSEC"):
+                if hasattr(cv2, prop):
+                    params += [getattr(cv2, prop), timeout_ms]
+        cap = cv2.VideoCapture(self.video_idx, cv2.CAP_ANY, params)
+        if not cap.isOpened():
+            cap.release()
+            return None
+        return cap
+
+    def run(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._grab_loop, daemon=True)
+        self._thread.start()
+
+    def _backoff(self, attempt: int) -> float:
+        delay = min(self.backoff_max, self.backoff_base * 2**attempt)
+        return delay * random.uniform(0.5, 1.0)
+
+    def _connect(self) -> bool:
+        """打开摄像头直到成功或被停止"""
+        attempt = 0
+        while not self._stop.is_set():
+            self.cap = self._open()
+            if self.cap is not None:
+                logger.info(f"camera {self.video_idx} connected")
+                return True
+            delay = self._backoff(attempt)
+            attempt += 1
+            logger.warning(
+                f"can't open camera {self.video_idx}, retry {attempt} in {delay:.1f}s"
+            )
+            self._stop.wait(delay)
+        return False
+
+    def _grab_loop(self):
+        # FFmpeg 解码线程由采集线程创建，继承相同的CPU绑定
+        pin_current_thread(self.cores)
+        try:
+            while not self._stop.is_set():
+                if self.cap is None:
+                    if not self._connect():
+                        break
+                    self.state = self.RUNNING
+                    last_frame_ts = time.time()
+                start = time.time()
+                ret, frame = self.cap.read()
+                now = time.time()
+                if not ret:
+                    if now - last_frame_ts > self.stall_timeout:
+                        logger.warning(
+                            f"camera {self.video_idx} stalled for "
+                            f"{now - last_frame_ts:.1f}s, reconnecting"
+                        )
+                        self.state = self.RECONNECTING
+                        self.stats.on_reconnect()
+                        self.cap.release()
+                        self.cap = None
+                    else:
+                        # 读取失败时避免空转
+                        self._stop.wait(0.01)
+                    continue
+                last_frame_ts = now
+                with self._cond:
+                    self.stats.on_capture(now - start, dropped=self._has_new)
+                    self._frame = frame
+                    self._has_new = True
+                    self.capture_ts = now
+                    self._cond.notify_all()
+                if self.on_frame:
+                    self.on_frame()
+        finally:
+            # 由采集线程自己释放，避免与阻塞中的 cap.read 并发
+            if self.cap is not None:
+                self.cap.release()
+                self.cap = None
+            self.state = self.STOPPED
 
     def read(self):
-        return self.cap.read()
+        if not self.threaded:
+            start = time.time()
+            ret, frame = self.cap.read()
+            if ret:
+                self.capture_ts = time.time()
+                self.stats.on_capture(self.capture_ts - start)
+                self.stats.on_read(0)
+            else:
+                self.stats.on_read(None)
+            return ret, frame
+
+        with self._cond:
+            if not self._has_new and self.wait:
+                self._cond.wait(self.wait)
+            if not self._has_new:
+                self.stats.on_read(None)
+                return False, None
+            self._has_new = False
+            self.stats.on_read(time.time() - self.capture_ts)
+            return True, self._frame
+
+    def queue_depth(self) -> int:
+        return int(self._has_new)
+
+    def release(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=1)
+        elif self.cap is not None:
+            self.cap.release()
+        self.state = self.STOPPED
+
+    def is_running(self):
+        if self.state != self.RUNNING:
+            return False
+        # cap.read 阻塞期间采集线程无法更新状态，按最新一帧的时间判断是否断流
+        return (
+            self.capture_ts is None
+            or time.time() - self.capture_ts < max(self.stall_timeout, 1) * 2
+        )
+
+
+class FramePool:
+    """
+    预分配的帧缓存池，缓存循环复用，避免采集时每帧申请新的内存
+    """
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.shape: Optional[Tuple[int, ...]] = None
+        self.buffers: List[np.ndarray] = []
+        self._free = deque()
+
+    def ensure(self, shape: Tuple[int, ...]) -> bool:
+        """分辨率变化时重新分配缓存，返回是否发生了重新分配"""
+        if self.shape == shape:
+            return False
+        self.shape = shape
+        self.buffers = [np.empty(shape, dtype=np.uint8) for _ in range(self.size)]
+        self._free = deque(range(self.size))
+        return True
+
+    def acquire(self) -> Optional[int]:
+        try:
+            return self._free.popleft()
+        except IndexError:
+            return None
+
+    def release(self, idx: int) -> None:
+        self._free.append(idx)
 
 
 class VideoAHDStreamer:
+    """
+    AHD 摄像头 GStreamer 采集
+
+    指定转换线程池时 appsink 直接输出 NV12，颜色转换由多摄像头共享的线程池完成，
+    不再每路摄像头各自启动 videoconvert 转换线程
+    """
 
     AHD_SRC_NO_WH = "v4l2src device=/dev/video{video_idx} ! video/x-raw,format=NV12,framerate=30/1 ! videoconvert n-threads=4 ! video/x-raw,format=BGR ! appsink name=sink emit-signals=True max-buffers=2 drop=True"
+    AHD_SRC_NV12 = "v4l2src device=/dev/video{video_idx} ! video/x-raw,format=NV12,framerate=30/1 ! appsink name=sink emit-signals=True max-buffers=2 drop=True"
 
-    def __init__(self, video_idx: str):
+    def __init__(
+        self,
+        video_idx: str,
+        buffer_size: int = 4,
+        on_frame: Optional[Callable[[], None]] = None,
+        pool: Optional[ConversionPool] = None,
+        cores: Optional[List[int]] = None,
+    ):
         try:
             import gi
         except ModuleNotFoundError:
@@ -51,9 +316,12 @@ class VideoAHDStreamer:
         from gi.repository import Gst
 
         self.video_idx = video_idx
+        self.pool = pool
+        self.cores = cores
         # 初始化 GStreamer
         Gst.init(None)
-        pipe_str = self.AHD_SRC_NO_WH.format(video_idx=video_idx)
+        pipe_tpl = self.AHD_SRC_NV12 if pool is not None else self.AHD_SRC_NO_WH
+        pipe_str = pipe_tpl.format(video_idx=video_idx)
         logger.info(f"gstreamer pipe: {pipe_str}")
         # 使用尽可能高效的管道设置
         self.pipeline = Gst.parse_launch(pipe_str)
@@ -61,37 +329,141 @@ class VideoAHDStreamer:
         if self.appsink:
             self.appsink.connect("new-sample", self.on_new_sample)
 
-        self.frame_queue = deque(maxlen=16)
+        # 队列中保存的是缓存池下标，最多缓存 buffer_size 帧，
+        # 另外一个缓存留给 sender 正在处理的帧
+        self.frame_pool = FramePool(buffer_size + 1)
+        # 各缓存中帧的采集完成时间
+        self.frame_ts: List[float] = [0.0] * self.frame_pool.size
+        # NV12 暂存缓存, 正在拷贝、等待转换、正在转换的帧各占一个
+        self.nv12_pool = FramePool(3)
+        self.frame_queue = deque()
+        self._inflight: Optional[int] = None
+        self._lock = threading.Lock()
+        self.stats = CaptureStats()
+        self.on_frame = on_frame
+        self._loop = None
+        self._running = False
         # 自动运行后台线程
         self.run()
 
+    def _acquire_frame_buffer(self, shape: Tuple[int, ...]) -> Tuple[int, bool]:
+        """获取一个空闲的 BGR 缓存，返回 (缓存下标, 是否丢弃了最旧的一帧)"""
+        with self._lock:
+            if self.frame_pool.ensure(shape):
+                logger.info(
+                    f"video idx: {self.video_idx} alloc frame pool {shape[1]}x{shape[0]}"
+                )
+                # 旧缓存由持有者自行释放引用，不再回收到新的缓存池
+                self.frame_queue.clear()
+                self._inflight = None
+            idx = self.frame_pool.acquire()
+            if idx is None:
+                # 没有空闲缓存时丢弃最旧的一帧，复用其缓存
+                return self.frame_queue.popleft(), True
+            return idx, False
+
+    def _publish(self, idx: int, start: float, dropped: bool) -> None:
+        now = time.time()
+        self.stats.on_capture(now - start, dropped=dropped)
+        with self._lock:
+            self.frame_ts[idx] = now
+            self.frame_queue.append(idx)
+        if self.on_frame:
+            self.on_frame()
+
     def on_new_sample(self, sink):
         from gi.repository import Gst
 
-        # 处理帧
+        # 处理帧, 统计从取样到 BGR 画面可用的耗时，使用转换线程池时包含排队时间
+        start = time.time()
         sample = sink.emit("pull-sample")
-        if sample:
-            buffer = sample.get_buffer()
-            caps = sample.get_caps()
-            height = caps.get_structure(0).get_value("height")
-            width = caps.get_structure(0).get_value("width")
-            success, map_info = buffer.map(Gst.MapFlags.READ)
-            if success:
-                frame = np.ndarray(
-                    shape=(height, width, 3), dtype=np.uint8, buffer=map_info.data
-                )
-                # 添加
-                logger.debug(f"video idx: {self.video_idx} append frame to queue!")
-                self.frame_queue.append(frame.copy())
-                buffer.unmap(map_info)
+        if not sample:
+            return Gst.FlowReturn.ERROR
+        buffer = sample.get_buffer()
+        caps = sample.get_caps()
+        height = caps.get_structure(0).get_value("height")
+        width = caps.get_structure(0).get_value("width")
+        # appsink 的 GstBuffer 会被上游复用，不能直接零拷贝交给 sender，
+        # 这里拷贝到预分配缓存中
+        success, map_info = buffer.map(Gst.MapFlags.READ)
+        if not success:
             return Gst.FlowReturn.OK
-        return Gst.FlowReturn.ERROR
+        try:
+            if self.pool is not None:
+                self._stage_nv12(map_info.data, height, width, start)
+            else:
+                idx, dropped = self._acquire_frame_buffer((height, width, 3))
+                np.copyto(
+                    self.frame_pool.buffers[idx],
+                    np.ndarray(
+                        shape=(height, width, 3), dtype=np.uint8, buffer=map_info.data
+                    ),
+                )
+        finally:
+            buffer.unmap(map_info)
+        if self.pool is None:
+            self._publish(idx, start, dropped)
+        return Gst.FlowReturn.OK
 
-    def read(self):
+    def _stage_nv12(self, data, height: int, width: int, start: float) -> None:
+        """拷贝 NV12 数据后提交到转换线程池，尚未转换的旧帧被新帧替换"""
+        shape = (height * 3 // 2, width)
+        with self._lock:
+            self.nv12_pool.ensure(shape)
+            idx = self.nv12_pool.acquire()
+        if idx is None:
+            self.stats.on_drop()
+            return
+        np.copyto(
+            self.nv12_pool.buffers[idx],
+            np.ndarray(shape=shape, dtype=np.uint8, buffer=data),
+        )
+        replaced = self.pool.submit(
+            self,
+            partial(self._convert, idx, shape, start),
+            discard=partial(self._release_nv12, idx, shape),
+        )
+        if replaced:
+            self.stats.on_drop()
+
+    def _release_nv12(self, idx: int, shape: Tuple[int, ...]) -> None:
+        with self._lock:
+            # 分辨率变化后旧缓存不再回收
+            if self.nv12_pool.shape == shape:
+                self.nv12_pool.release(idx)
+
+    def _convert(self, idx: int, shape: Tuple[int, ...], start: float) -> None:
+        """在转换线程池中执行, 同一摄像头的转换不会并发"""
         try:
-            return True, self.frame_queue.popleft()
-        except IndexError:
-            return False, None
+            if self.nv12_pool.shape != shape:
+                return
+            bidx, dropped = self._acquire_frame_buffer((shape[0] * 2 // 3, shape[1], 3))
+            cv2.cvtColor(
+                self.nv12_pool.buffers[idx],
+                cv2.COLOR_YUV2BGR_NV12,
+                dst=self.frame_pool.buffers[bidx],
+            )
+        finally:
+            self._release_nv12(idx, shape)
+        self._publish(bidx, start, dropped)
+
+    def read(self):
+        with self._lock:
+            # sender 串行处理同一摄像头的帧，再次读取时上一帧已写入共享内存, 回收其缓存
+            if self._inflight is not None:
+                self.frame_pool.release(self._inflight)
+                self._inflight = None
+            try:
+                idx = self.frame_queue.popleft()
+            except IndexError:
+                self.stats.on_read(None)
+                return False, None
+            self._inflight = idx
+            self.stats.on_read(time.time() - self.frame_ts[idx])
+            return True, self.frame_pool.buffers[idx]
+
+    def queue_depth(self) -> int:
+        return len(self.frame_queue)
 
     def run(self):
         threading.Thread(target=self._start_gstreamer_loop).start()
@@ -99,18 +471,301 @@ class VideoAHDStreamer:
     def _start_gstreamer_loop(self):
         from gi.repository import Gst, GLib
 
+        # 在启动管道前绑定，管道的流线程尽量继承相同的CPU绑定
+        pin_current_thread(self.cores)
         self.pipeline.set_state(Gst.State.PLAYING)
-        loop = GLib.MainLoop()
+        self._loop = GLib.MainLoop()
         try:
             self._running = True
-            loop.run()
+            self._loop.run()
         except KeyboardInterrupt:
             logger.warning("Stopping... ")
             # 停止
-            loop.quit()
+            self._loop.quit()
         finally:
             self.pipeline.set_state(Gst.State.NULL)
             self._running = False
 
+    def release(self):
+        from gi.repository import Gst
+
+        self.pipeline.set_state(Gst.State.NULL)
+        if self.pool is not None:
+            self.pool.cancel(self)
+        if self._loop:
+            self._loop.quit()
+
     def is_running(self):
         return self._running
+
+
+class ReplayStreamer:
+    """
+    本地模拟视频源基类，用于在没有摄像头的机器上压测整条链路
+
+    fps > 0 时按实时节奏产生画面，sender 来不及读取的帧计入丢帧统计；
+    fps 为 0 时不限速, sender 取走上一帧后立即产生下一帧，用于测量链路的最大吞吐
+    """
+
+    def __init__(
+        self,
+        fps: float = 25,
+        wait: float = 0.1,
+        on_frame: Optional[Callable[[], None]] = None,
+        cores: Optional[List[int]] = None,
+    ) -> None:
+        self.fps = fps
+        self.wait = wait
+        self.on_frame = on_frame
+        self.cores = cores
+        self.stats = CaptureStats()
+        self.capture_ts: Optional[float] = None
+        self._frame: Optional[np.ndarray] = None
+        self._has_new = False
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread: Optional[threading.Thread] = None
+
+    def run(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._produce_loop, daemon=True)
+        self._thread.start()
+
+    def next_frame(self) -> Optional[np.ndarray]:
+        """产生下一帧, 返回 None 表示视频源结束"""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+    def _pace(self, next_ts: float) -> float:
+        """实时模式下等待到下一帧的时间点，返回再下一帧的时间点"""
+        interval = 1 / self.fps
+        delay = next_ts - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        next_ts += interval
+        # 产生画面耗时超过帧间隔时重新对齐，不补发积压的帧
+        if time.time() - next_ts > interval:
+            next_ts = time.time()
+        return next_ts
+
+    def _produce_loop(self):
+        pin_current_thread(self.cores)
+        next_ts = time.time()
+        while self._running:
+            if self.fps > 0:
+                next_ts = self._pace(next_ts)
+            else:
+                with self._cond:
+                    while self._running and self._has_new:
+                        self._cond.wait(0.1)
+            if not self._running:
+                break
+            start = time.time()
+            frame = self.next_frame()
+            if frame is None:
+                logger.info(f"{self.__class__.__name__} source finished")
+                self._running = False
+                break
+            now = time.time()
+            with self._cond:
+                self.stats.on_capture(now - start, dropped=self._has_new)
+                self._frame = frame
+                self._has_new = True
+                self.capture_ts = now
+                self._cond.notify_all()
+            if self.on_frame:
+                self.on_frame()
+
+    def read(self):
+        with self._cond:
+            if not self._has_new and self.wait:
+                self._cond.wait(self.wait)
+            if not self._has_new:
+                self.stats.on_read(None)
+                return False, None
+            self._has_new = False
+            self.stats.on_read(time.time() - self.capture_ts)
+            # 唤醒不限速模式下等待读取的生产线程
+            self._cond.notify_all()
+            return True, self._frame
+
+    def queue_depth(self) -> int:
+        return int(self._has_new)
+
+    def release(self):
+        self._running = False
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout=1)
+        self.close()
+
+    def is_running(self):
+        return self._running
+
+
+class VideoFileStreamer(ReplayStreamer):
+    """
+    循环播放本地视频文件, fps 为空时按视频文件自身的帧率播放
+    """
+
+    def __init__(
+        self,
+        path: str,
+        fps: Optional[float] = None,
+        loop: bool = True,
+        wait: float = 0.1,
+        on_frame: Optional[Callable[[], None]] = None,
+        cores: Optional[List[int]] = None,
+    ) -> None:
+        self.cap = cv2.VideoCapture(path)
+        if not self.cap.isOpened():
+            raise ValueError(f"can't open video file {path}!")
+        if fps is None:
+            fps = self.cap.get(cv2.CAP_PROP_FPS) or 25
+        super().__init__(fps=fps, wait=wait, on_frame=on_frame, cores=cores)
+        self.path = path
+        self.loop = loop
+        self.run()
+
+    def next_frame(self) -> Optional[np.ndarray]:
+        ret, frame = self.cap.read()
+        if not ret and self.loop:
+            # 播放结束后从头开始
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.cap.read()
+        return frame if ret else None
+
+    def close(self) -> None:
+        self.cap.release()
+
+
+class ImageDirStreamer(ReplayStreamer):
+    """
+    按文件名顺序循环回放目录中的图片, 每帧都重新解码, 与真实视频源的解码开销接近
+    """
+
+    extensions = (".jpg", ".jpeg", ".png", ".bmp")
+
+    def __init__(
+        self,
+        path: str,
+        fps: float = 25,
+        loop: bool = True,
+        wait: float = 0.1,
+        on_frame: Optional[Callable[[], None]] = None,
+        cores: Optional[List[int]] = None,
+    ) -> None:
+        super().__init__(fps=fps, wait=wait, on_frame=on_frame, cores=cores)
+        self.files = sorted(
+            fp
+            for fp in glob.glob(os.path.join(path, "*"))
+            if fp.lower().endswith(self.extensions)
+        )
+        if not self.files:
+            raise ValueError(f"no images found in {path}!")
+        self.loop = loop
+        self._index = 0
+        self.run()
+
+    def next_frame(self) -> Optional[np.ndarray]:
+        for _ in range(len(self.files)):
+            if self._index >= len(self.files):
+                if not self.loop:
+                    return None
+                self._index = 0
+            fp = self.files[self._index]
+            self._index += 1
+            frame = cv2.imread(fp)
+            if frame is not None:
+                return frame
+            logger.warning(f"read image {fp} error, skip")
+        return None
+
+
+class SyntheticStreamer(ReplayStreamer):
+    """
+    生成指定分辨率的模拟画面, 画面中有移动的色块及帧号，画面变化检测等逻辑可以正常工作
+    """
+
+    def __init__(
+        self,
+        width: int = 1920,
+        height: int = 1080,
+        fps: float = 25,
+        wait: float = 0.1,
+        on_frame: Optional[Callable[[], None]] = None,
+        cores: Optional[List[int]] = None,
+    ) -> None:
+        super().__init__(fps=fps, wait=wait, on_frame=on_frame, cores=cores)
+        self.width = width
+        self.height = height
+        # 背景只生成一次，每帧拷贝后绘制移动色块
+        gradient = np.linspace(0, 255, width, dtype=np.uint8)
+        self.background = np.empty((height, width, 3), dtype=np.uint8)
+        self.background[:] = gradient[None, :, None]
+        self._index = 0
+        self.run()
+
+    def next_frame(self) -> Optional[np.ndarray]:
+        frame = self.background.copy()
+        size = max(self.height // 8, 1)
+        x = (self._index * 8) % max(self.width - size, 1)
+        y = (self.height - size) // 2
+        cv2.rectangle(frame, (x, y), (x + size, y + size), (0, 0, 255), -1)
+        cv2.putText(
+            frame,
+            str(self._index),
+            (10, max(self.height // 10, 20)),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            max(self.height / 720, 0.5),
+            (255, 255, 255),
+            2,
+        )
+        self._index += 1
+        return frame
+
+
+def create_replay_streamer(
+    url: str,
+    wait: float = 0.1,
+    on_frame: Optional[Callable[[], None]] = None,
+    cores: Optional[List[int]] = None,
+) -> Optional[ReplayStreamer]:
+    """
+    根据 url 创建模拟视频源, 非模拟视频源的 url 返回 None
+
+    支持的 url:
+        file://<视频路径>?fps=25&loop=1     循环播放视频文件, fps 默认为视频自身帧率
+        images://<图片目录>?fps=25&loop=1   循环回放目录中的图片
+        synthetic://1920x1080?fps=25        生成模拟画面
+    fps=0 表示不限速
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ("file", "images", "synthetic"):
+        return None
+    query = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+    fps = float(query["fps"]) if "fps" in query else None
+    loop = query.get("loop", "1") not in ("0", "false")
+    # 兼容 file://relative/path 形式的相对路径
+    path = parts.netloc + parts.path
+
+    if parts.scheme == "file":
+        return VideoFileStreamer(
+            path, fps=fps, loop=loop, wait=wait, on_frame=on_frame, cores=cores
+        )
+    if fps is None:
+        fps = 25
+    if parts.scheme == "images":
+        return ImageDirStreamer(
+            path, fps=fps, loop=loop, wait=wait, on_frame=on_frame, cores=cores
+        )
+    try:
+        width, height = (int(v) for v in path.lower().split("x"))
+    except ValueError:
+        raise ValueError(f"invalid synthetic resolution {path}, e.g. 1920x1080")
+    return SyntheticStreamer(
+        width, height, fps=fps, wait=wait, on_frame=on_frame, cores=cores
+    )
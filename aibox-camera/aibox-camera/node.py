@@ -1,7 +1,10 @@
 import sys
 import time
 import signal
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
 
 from coral import (
     CoralNode,
@@ -14,15 +17,20 @@ from coral import (
 from loguru import logger
 from coral.sched import SharedMemoryIDManager
 from coral.exception import CoralSenderIgnoreException
+from pydantic import Field
 
 import web
-from schema import CameraParamsModel
-from algrothms.streamer import VideoStreamer
+from schema import CameraParamsModel, CaptureParamsModel, MotionParamsModel
+from algrothms.governor import FpsGovernor
+from algrothms.manager import CameraManager
+from algrothms.motion import MotionDetector
 
 
 def signal_restart(signal, frame):
     logger.info("receive signal: {}".format(signal))
     SharedMemoryIDManager.clear_all_memory()
+    if web.camera_manager:
+        web.camera_manager.release()
     web.stop_main_thread()
     sys.exit(0)
 
@@ -37,6 +45,19 @@ SharedMemoryIDManager.clear_all_memory()
 class AIboxCameraParamsModel(BaseParamsModel):
     cameras: List[CameraParamsModel] = [CameraParamsModel()]
     resolution: str = "low"
+    ingest_height: Optional[int] = Field(
+        default=None,
+        description="写入共享内存的画面高度, 为空表示原图; 不会低于预览/录像所需的分辨率",
+    )
+    max_total_fps: Optional[float] = Field(
+        default=None, description="所有摄像头总帧率上限, 为空表示不限制"
+    )
+    motion: MotionParamsModel = MotionParamsModel()
+    capture: CaptureParamsModel = CaptureParamsModel()
+    preview_fps: float = Field(default=15, description="web预览帧率")
+    snapshot_interval: float = Field(
+        default=1.0, description="绘制Mask使用的原图快照刷新间隔(秒)"
+    )
 
 
 class AIboxCamera(CoralNode):
@@ -56,6 +77,18 @@ class AIboxCamera(CoralNode):
         # 更新node_id变量，并启动web服务
         web.node_id = self.config.node_id
         web.is_actived = self.is_active
+        # 摄像头采集与 worker 解耦，支持运行时增删摄像头
+        self.camera_manager = CameraManager(
+            workers=self.process.count,
+            resolution=self.params.resolution,
+            max_total_fps=self.params.max_total_fps,
+            convert_workers=self.params.capture.convert_workers,
+            capture_cores=self.params.capture.cores,
+        )
+        web.camera_manager = self.camera_manager
+        web.contexts = self.camera_manager.contexts
+        web.preview_fps = self.params.preview_fps
+        web.snapshot_interval = self.params.snapshot_interval
         web.async_run(self.config.node_id)
 
     def init(self, index: int, context: dict):
@@ -73,20 +106,15 @@ class AIboxCamera(CoralNode):
             )
 
         if self.process.count != len(cameras):
-            raise ValueError(
-                f"摄像头数量与启动线程数不匹配, 设置 process -> count 为 {len(cameras)}"
+            logger.warning(
+                f"摄像头数量 {len(cameras)} 与启动线程数 {self.process.count} 不一致, "
+                f"摄像头将按线程轮流分配"
             )
 
-        camera = cameras[index]
-        url: str = camera["url"]
-        vc = VideoStreamer(url)
-        context["vc"] = vc
-        context.update(camera)
-        # 写入所有摄像头ID到每一帧画面中
-        # context["params"]["camera_ids"] = [_cam["name"] for _cam in cameras]
-        context["resolution"] = self.params.resolution
-        # 更新web的全局变量
-        web.contexts[camera["name"]] = context
+        # 初始摄像头按 worker 下标轮流分配，运行时新增的摄像头分配给负载最小的 worker
+        for camera in cameras[index :: self.process.count]:
+            self.camera_manager.add(camera, worker=index)
+        context["index"] = index
 
     def sender(self, payload: RawPayload, context: Dict) -> FirstPayload:
         """
@@ -96,21 +124,83 @@ class AIboxCamera(CoralNode):
         :param context: 上下文参数
         :return: 数据
         """
-        vc: VideoStreamer = context["vc"]
-        ret, frame = vc.read()
-        if not ret:
+        camera_context, frame = self.camera_manager.read(context["index"])
+        if camera_context is None:
             raise CoralSenderIgnoreException("读取频率过高, 队列为空")
 
-        # 将摄像头拷贝数据web读取写入队列
-        web.cameras_queue[context["name"]].append(frame.copy())
+        governor: FpsGovernor = camera_context["governor"]
+        if not governor.allow():
+            raise CoralSenderIgnoreException("未到目标帧率间隔, 跳过当前帧")
+
+        camera_id = camera_context["name"]
+        camera_height = web.resolution_height_mapper(camera_context["resolution"])
+        # 原图快照仅在web请求后低频拷贝
+        if web.snapshot_wanted(camera_id):
+            web.publish_snapshot(camera_id, frame.copy())
+
+        # 在源头缩放到下游所需的最大分辨率，减少共享内存传输及各节点的缩放开销
+        raw, scale = self.downscale(frame, camera_height)
+        params = camera_context["params"]
+        if scale != 1.0:
+            params = {
+                **params,
+                "points": [
+                    [int(x * scale), int(y * scale)] for x, y in params["points"]
+                ],
+            }
+
+        # 有预览连接时才将缩放到预览分辨率的画面写入web广播
+        if web.preview_wanted(camera_id):
+            web.publish_frame(camera_id, raw, camera_height)
 
         raw_params = {
-            **context["params"],
-            "camera_height": web.resolution_height_mapper(context["resolution"]),
-            "camera_ids": [cam.name for cam in self.params.cameras],
+            **params,
+            "camera_height": camera_height,
+            "camera_ids": self.camera_manager.camera_ids,
+            "ingest_scale": scale,
         }
+        # 画面变化检测，下游对未变化的帧复用上一次识别结果
+        if self.params.motion.enable:
+            score, changed = self.detect_motion(camera_context, raw)
+            raw_params["motion"] = {"score": score, "changed": changed}
+
+        return FirstPayload(source_id=camera_id, raw=raw, raw_params=raw_params)
+
+    def detect_motion(self, camera_context: Dict, frame: np.ndarray):
+        detector: MotionDetector = camera_context.get("motion")
+        if detector is None:
+            params = self.params.motion
+            detector = MotionDetector(
+                thumb_width=params.thumb_width,
+                pixel_threshold=params.pixel_threshold,
+                threshold=params.threshold,
+                keyframe_interval=params.keyframe_interval,
+            )
+            camera_context["motion"] = detector
+        return detector.update(frame)
 
-        return FirstPayload(source_id=context["name"], raw=frame, raw_params=raw_params)
+    def downscale(
+        self, frame: np.ndarray, camera_height: Optional[int]
+    ) -> Tuple[np.ndarray, float]:
+        """
+        按 ingest_height 在源头缩放画面
+
+        :param frame: 原始画面
+        :param camera_height: 预览/录像使用的分辨率, 为空表示需要原图
+        :return: (缩放后的画面, 缩放比例)
+        """
+        ingest_height = self.params.ingest_height
+        if not ingest_height or not camera_height:
+            return frame, 1.0
+        target_height = max(ingest_height, camera_height)
+        oh, ow = frame.shape[:2]
+        if oh <= target_height:
+            return frame, 1.0
+        scale = target_height / oh
+        raw = cv2.resize(
+            frame, (int(ow * scale), target_height), interpolation=cv2.INTER_AREA
+        )
+        return raw, scale
 
 
 if __name__ == "__main__":
@@ -10,8 +10,34 @@ class ParamsModel(BaseModel):
 
 class CameraParamsModel(BaseModel):
     name: str = "camera01"
-    url: str = Field(default="0", description="摄像头url")
+    url: str = Field(
+        default="0",
+        description="摄像头url, 压测时可使用 file://、images://、synthetic:// 模拟视频源",
+    )
     params: ParamsModel = ParamsModel()
+    target_fps: Optional[float] = Field(
+        default=None, description="目标帧率, 为空表示按摄像头实际帧率输出"
+    )
+
+
+class MotionParamsModel(BaseModel):
+    enable: bool = Field(default=False, description="是否开启画面变化检测")
+    thumb_width: int = Field(default=64, description="检测用缩略图宽度")
+    pixel_threshold: int = Field(default=20, description="像素灰度变化阈值")
+    threshold: float = Field(default=0.01, description="变化像素占比阈值")
+    keyframe_interval: int = Field(
+        default=25, description="连续静止帧数达到该值时强制下游重新识别"
+    )
+
+
+class CaptureParamsModel(BaseModel):
+    convert_workers: int = Field(
+        default=0,
+        description="多摄像头共享的颜色转换线程数, 为 0 时不开启, 各摄像头在自己的采集管道中转换; 开启后 OpenCV 内部线程数设为 1",
+    )
+    cores: List[int] = Field(
+        default=[], description="采集及转换线程绑定的CPU核心, 为空时不绑定"
+    )
 
 
 class CameraOps:
@@ -1,14 +1,15 @@
 import io
 import os
+import asyncio
 import json
 import shutil
 import subprocess
 import sys
 import time
-from typing import Dict, List
+from typing import Dict, List, Set
 from threading import Thread
 from urllib.parse import urljoin
-from collections import defaultdict, deque
+from collections import defaultdict
 
 import cv2
 import requests
@@ -16,18 +17,30 @@ import uvicorn
 import numpy as np
 from loguru import logger
 from coral.constants import MOUNT_PATH
-from fastapi import FastAPI, APIRouter, HTTPException
-from fastapi.responses import FileResponse, StreamingResponse, Response
+from fastapi import FastAPI, APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 
 from schema import ChangeResolutionModel, ParamsModel, CameraParamsModel, CameraOps
+from algrothms.broadcast import FrameBroadcaster, resize_to_height
+from algrothms.snapshot import SnapshotCache
 
 # 全局变量
 node_id = None
 contexts = {}
-stop_stream = False
+camera_manager = None
+# 预览帧率, 由节点参数设置
+preview_fps = 15
 is_actived = False
-cameras_queue: Dict[str, deque] = defaultdict(lambda: deque(maxlen=5))
+# 快照刷新间隔, 由节点参数设置
+snapshot_interval = 1.0
+# 原始分辨率快照, 画面在源头缩放后仍可用原图坐标绘制Mask
+snapshots: Dict[str, SnapshotCache] = defaultdict(
+    lambda: SnapshotCache(interval=snapshot_interval)
+)
+# 每个预览连接的停止事件，按摄像头分组
+stream_stops: Dict[str, Set[asyncio.Event]] = defaultdict(set)
+broadcasters: Dict[str, FrameBroadcaster] = defaultdict(FrameBroadcaster)
 
 MOUNT_NODE_PATH = os.path.join(MOUNT_PATH, "aibox")
 os.makedirs(MOUNT_NODE_PATH, exist_ok=True)
@@ -97,6 +110,30 @@ def stop_main_thread():
     Thread(target=os_kill).start()
 
 
+def preview_wanted(camera_id: str) -> bool:
+    """仅在有预览连接时按预览帧率取帧，无人观看时不产生任何拷贝"""
+    broadcaster = broadcasters.get(camera_id)
+    return broadcaster is not None and broadcaster.wants_frame(preview_fps)
+
+
+def publish_frame(camera_id: str, frame: np.ndarray, height: int = None) -> None:
+    # 缩放到预览分辨率, 缩放本身会生成新的数据，未缩放时才需要拷贝
+    preview = resize_to_height(frame, height)
+    if preview is frame:
+        preview = frame.copy()
+    broadcasters[camera_id].publish(preview)
+
+
+def snapshot_wanted(camera_id: str) -> bool:
+    """仅在最近有快照请求且快照过期时刷新"""
+    snapshot = snapshots.get(camera_id)
+    return snapshot is not None and snapshot.due()
+
+
+def publish_snapshot(camera_id: str, frame: np.ndarray) -> None:
+    snapshots[camera_id].update(frame)
+
+
 def draw_mask_lines(frame, points: List[List[int]]):
     points = np.array(points, dtype=np.int32)
     cv2.polylines(frame, [points], isClosed=True, color=(0, 0, 255), thickness=2)
@@ -199,6 +236,8 @@ def change_resolution(item: ChangeResolutionModel):
     # 动态修改分辨率
     for camera_id in contexts:
         contexts[camera_id]["resolution"] = item.level
+    if camera_manager:
+        camera_manager.resolution = item.level
     durable_resolution_config(item.level)
     return {"result": "success"}
 
@@ -209,45 +248,75 @@ def is_actived_view():
 
 
 @router.get("/cameras/stop_stream")
-def stop_stream_view():
-    global stop_stream
-    stop_stream = True
+async def stop_stream_view(camera_id: str = None):
+    # 只停止当前已建立的连接，不影响之后新建立的预览
+    camera_ids = [camera_id] if camera_id else list(stream_stops.keys())
+    for _camera_id in camera_ids:
+        for stop in stream_stops.get(_camera_id, ()):
+            stop.set()
     return {"result": "success"}
 
 
+@router.get("/cameras/stats", summary="采集统计")
+def get_cameras_stats():
+    cameras = {}
+    for camera_id in camera_manager.camera_ids:
+        try:
+            cameras[camera_id] = camera_manager.stats(camera_id)
+        except KeyError:
+            # 统计期间摄像头被删除
+            continue
+    return {
+        "cameras": cameras,
+        "workers": camera_manager.worker_stats(),
+        "conversion": camera_manager.conversion_stats(),
+    }
+
+
+@router.get("/cameras/{camera_id}/stats", summary="单个摄像头采集统计")
+def get_camera_stats(camera_id: str):
+    try:
+        return camera_manager.stats(camera_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="摄像头不存在")
+
+
 @router.get("/cameras/{camera_id}/stream")
-def video_stream(camera_id: str):
-    global stop_stream
-    stop_stream = False
-
-    def gen_frame():
-        camera_height = resolution_height_mapper(contexts[camera_id]["resolution"])
-        while True:
-            try:
-                frame = cameras_queue[camera_id].popleft()
-            except IndexError:
-                # 队列不存在值
-                time.sleep(0.01)
-                continue
-
-            if stop_stream:
-                logger.info(f"{camera_id} stop stream!")
-                break
-
-            # 修改分辨率
-            if camera_height:
-                oh, ow = frame.shape[:2]
-                scale = camera_height / oh
-                frame = cv2.resize(frame, (int(ow * scale), int(camera_height)))
-
-            ret, frame = cv2.imencode(".jpg", frame)
-            if not ret:
-                raise HTTPException(status_code=500, detail="图像编码失败！")
-            bframe = frame.tobytes()
-            yield (
-                b"--frame\r\n"
-                b"Content-Type: image/jpeg\r\n\r\n" + bframe + b"\r\n\r\n"
-            )
+async def video_stream(camera_id: str, request: Request):
+    if camera_id not in contexts:
+        raise HTTPException(status_code=404, detail=f"摄像头 {camera_id} 不存在")
+
+    stop = asyncio.Event()
+    stream_stops[camera_id].add(stop)
+
+    async def gen_frame():
+        broadcaster = broadcasters[camera_id]
+        broadcaster.subscribe()
+        seq = 0
+        try:
+            while not stop.is_set() and camera_id in contexts:
+                # 分辨率可动态修改，每帧读取一次
+                camera_height = resolution_height_mapper(
+                    contexts[camera_id]["resolution"]
+                )
+                try:
+                    seq, bframe = await broadcaster.get(camera_height, seq)
+                except ValueError as e:
+                    raise HTTPException(status_code=500, detail=str(e))
+                if bframe is None:
+                    # 超时无新帧, 顺便检查连接是否已断开
+                    if await request.is_disconnected():
+                        break
+                    continue
+
+                yield (
+                    b"--frame\r\n"
+                    b"Content-Type: image/jpeg\r\n\r\n" + bframe + b"\r\n\r\n"
+                )
+        finally:
+            broadcaster.unsubscribe()
+            stream_stops[camera_id].discard(stop)
+            logger.info(f"{camera_id} stop stream!")
 
     return StreamingResponse(
         gen_frame(), media_type="multipart/x-mixed-replace; boundary=frame"
@@ -255,30 +324,27 @@ def video_stream(camera_id: str):
 
 
 @router.get("/cameras/{camera_id}/draw-mask", summary="绘制Mask")
-def draw_mask(camera_id: str, points: str = None):
-    while True:
-        try:
-            frame = cameras_queue[camera_id].popleft()
-            break
-        except IndexError:
-            # 队列不存在值
-            time.sleep(0.01)
-            continue
-
+def draw_mask(camera_id: str, request: Request, points: str = None):
+    if camera_id not in contexts:
+        raise HTTPException(status_code=404, detail="摄像头不存在")
     if points:
         points = points.split(",")
-        points = [
-            [int(points[idx]), int(points[idx + 1])] for idx in range(0, len(points), 2)
-        ]
-        draw_mask_lines(frame, points)
-    _dir = os.path.join(MOUNT_NODE_PATH, "cameras", camera_id)
-    os.makedirs(_dir, exist_ok=True)
-    fp = os.path.join(_dir, "mask.jpg")
-    # 先删除旧文件
-    if os.path.exists(fp):
-        os.remove(fp)
-    cv2.imwrite(fp, frame)
-    return FileResponse(fp, media_type="image/jpeg")
+        # mask 坐标始终基于原图
+        points = tuple(
+            (int(points[idx]), int(points[idx + 1])) for idx in range(0, len(points), 2)
+        )
+    snapshot = snapshots[camera_id].get(points or None, draw_mask_lines)
+    if snapshot is None:
+        raise HTTPException(status_code=504, detail="获取摄像头画面超时")
+    etag, timestamp, data = snapshot
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "no-cache",
+        "X-Snapshot-Timestamp": f"{timestamp:.3f}",
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=data, media_type="image/jpeg", headers=headers)
 
 
 @router.get("/cameras/{camera_id}/config")
@@ -294,7 +360,10 @@ def change_camera_params(camera_id: str, item: ParamsModel):
     durable_config(
         camera_id,
         CameraParamsModel(
-            name=context["name"], url=context["url"], params=context["params"]
+            name=context["name"],
+            url=context["url"],
+            params=context["params"],
+            target_fps=context["target_fps"],
         ),
         ops=CameraOps.CHANGE,
     )
@@ -307,9 +376,15 @@ def add_camera(item: CameraParamsModel):
         # 持久化
         durable_config(item.name, item, ops=CameraOps.ADD)
     except Exception as e:
-        return HTTPException(status_code=500, detail=str(e))
-    # 重启服务
-    restart_main_thread()
+        raise HTTPException(status_code=500, detail=str(e))
+    # 运行时启动摄像头采集，其他摄像头不受影响
+    try:
+        camera_manager.add(item.model_dump())
+    except Exception as e:
+        logger.exception(f"start camera {item.name} error: {e}")
+        # 回滚配置
+        durable_config(item.name, ops=CameraOps.DELETE)
+        raise HTTPException(status_code=500, detail=f"启动摄像头失败: {e}")
     return item.model_dump()
 
 
@@ -317,8 +392,11 @@ def add_camera(item: CameraParamsModel):
 def delete_camera(camera_id: str):
     # 持久化
     durable_config(camera_id, ops=CameraOps.DELETE)
-    # 重启服务
-    restart_main_thread()
+    # 运行时停止摄像头采集及其预览
+    camera_manager.remove(camera_id)
+    # 预览连接在下一次等待超时时检查摄像头是否存在并退出
+    broadcasters.pop(camera_id, None)
+    snapshots.pop(camera_id, None)
     return {"name": camera_id}
 
 
@@ -0,0 +1,103 @@
+"""
+人脸识别结果预览广播，sender 发布最新结果后通知等待中的预览连接
+"""
+
+import time
+import asyncio
+import threading
+from typing import Any, Callable, Optional, Set, Tuple
+
+
+class PayloadBroadcaster:
+    """
+    单个摄像头的识别结果广播
+
+    只保存最新一条消息，每条消息只渲染一次，所有预览连接共享渲染结果
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._render_lock = threading.Lock()
+        self._message: Any = None
+        self._seq = 0
+        self._rendered: Optional[bytes] = None
+        self.subscribers = 0
+        self._next_publish_ts = 0.0
+        self._waiters: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+
+    def subscribe(self) -> None:
+        with self._lock:
+            self.subscribers += 1
+
+    def unsubscribe(self) -> None:
+        with self._lock:
+            self.subscribers -= 1
+            if not self.subscribers:
+                # 没有订阅者时释放最后一条消息
+                self._message = None
+                self._rendered = None
+
+    def wants_frame(self, fps: float) -> bool:
+        """有订阅者且距上次发布已超过预览帧间隔时才需要发布"""
+        if not self.subscribers:
+            return False
+        now = time.time()
+        with self._lock:
+            if now < self._next_publish_ts:
+                return False
+            self._next_publish_ts = now + 1 / fps
+        return True
+
+    def publish(self, message: Any) -> None:
+        with self._lock:
+            self._message = message
+            self._seq += 1
+            self._rendered = None
+            waiters, self._waiters = self._waiters, set()
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def _render(self, seq: int, message: Any, render: Callable[[Any], bytes]) -> bytes:
+        with self._render_lock:
+            with self._lock:
+                data = self._rendered if seq == self._seq else None
+            if data is None:
+                data = render(message)
+                with self._lock:
+                    if seq == self._seq:
+                        self._rendered = data
+        return data
+
+    async def get(
+        self, last_seq: int, render: Callable[[Any], bytes], timeout: float = 1.0
+    ) -> Tuple[int, Optional[bytes]]:
+        """
+        等待并获取比 last_seq 更新的一帧渲染结果
+
+        :param last_seq: 连接上一次拿到的消息序号
+        :param render: 将消息渲染为JPEG数据的函数, 在线程池中执行
+        :param timeout: 等待新消息的超时时间
+        :return: (消息序号, JPEG数据)，超时未有新消息时数据为 None
+        """
+        loop = asyncio.get_running_loop()
+        waiter = None
+        with self._lock:
+            if self._seq == last_seq:
+                waiter = (loop, asyncio.Event())
+                self._waiters.add(waiter)
+        if waiter:
+            try:
+                await asyncio.wait_for(waiter[1].wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                with self._lock:
+                    self._waiters.discard(waiter)
+
+        with self._lock:
+            if self._seq == last_seq or self._message is None:
+                return last_seq, None
+            seq, message, data = self._seq, self._message, self._rendered
+        if data is None:
+            data = await loop.run_in_executor(None, self._render, seq, message, render)
+        return seq, data
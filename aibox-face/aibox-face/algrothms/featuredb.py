@@ -1,9 +1,10 @@
 import os
 import shutil
 import platform
+import threading
 from io import BytesIO
 from uuid import uuid4
-from typing import List, Dict
+from typing import List, Dict, Optional
 from collections import defaultdict
 
 import cv2
@@ -12,6 +13,7 @@ from loguru import logger
 from PIL import Image
 import numpy as np
 
+from .quantize import check_precision, dot, quantize
 from .utils import get_import_meta
 
 
@@ -28,6 +30,7 @@ class FeatureDB:
         use_preprocess: bool = True,
         user_faces_size: int = 10,
         sim_threshold: float = 0.9,
+        precision: str = "float32",
         *args,
         **kwargs,
     ):
@@ -55,10 +58,19 @@ class FeatureDB:
         self.db_path = db_path
         self.user_faces_size = user_faces_size
         self.sim_threshold = sim_threshold
-
-        # pre load data save
-        self.images = []
-        self.features = []
+        # 内存中特征的存储精度, 文件中的特征始终为 float32
+        self.dtype = check_precision(precision)
+
+        # 识别线程比较时不加锁, 增删特征时持锁
+        self._lock = threading.Lock()
+        # 归一化后按存储精度逐行保存的特征矩阵及其缩放系数, 容量按倍数扩容,
+        # 删除时用最后一行填补被删除的行
+        self._codes: Optional[np.ndarray] = None
+        self._scales = np.empty(0, dtype=np.float32)
+        self._count = 0
+        # 行号 -> key, key -> 行号
+        self.images: List[str] = []
+        self._rows: Dict[str, int] = {}
         self.mapper = {}
         # load users
         self.load_users()
@@ -75,6 +87,66 @@ class FeatureDB:
         similarity = dot_product / (norm_a * norm_b)
         return similarity
 
+    @classmethod
+    def parse_vector(cls, content: bytes) -> np.ndarray:
+        """远程节点的特征文件为 np.save 格式, 否则按原始 float32 数据解析"""
+        if content.startswith(b"\x93NUMPY"):
+            vector = np.load(BytesIO(content))
+        else:
+            vector = np.frombuffer(content, dtype=np.float32)
+        return vector.astype(np.float32)
+
+    def _add_feature(self, key: str, feature: np.ndarray, user_id: str):
+        feature = np.asarray(feature, dtype=np.float32).reshape(1, -1)
+        norm = np.linalg.norm(feature)
+        codes, scales = quantize(feature / norm if norm > 0 else feature, self.dtype)
+        with self._lock:
+            row = self._rows.get(key)
+            if row is None:
+                self._reserve(codes.shape[1])
+                row = self._count
+            self._codes[row] = codes[0]
+            self._scales[row] = scales[0]
+            if key not in self._rows:
+                self._rows[key] = row
+                self.images.append(key)
+                # 特征写入后再增加数量, 比较时读到的行都已写入
+                self._count += 1
+            self.mapper[key] = user_id
+
+    def _reserve(self, dim: int):
+        if self._codes is None:
+            self._codes = np.empty((16, dim), dtype=self.dtype)
+            self._scales = np.empty(16, dtype=np.float32)
+        elif self._count == len(self._codes):
+            # 容量不足时翻倍扩容
+            codes = np.empty((len(self._codes) * 2, dim), dtype=self.dtype)
+            codes[: self._count] = self._codes[: self._count]
+            scales = np.empty(len(codes), dtype=np.float32)
+            scales[: self._count] = self._scales[: self._count]
+            self._codes, self._scales = codes, scales
+
+    def _remove_feature(self, key: str):
+        with self._lock:
+            self.mapper.pop(key, None)
+            row = self._rows.pop(key, None)
+            if row is None:
+                return
+            last = self._count - 1
+            if row != last:
+                # 最后一行移动到被删除的行
+                self._codes[row] = self._codes[last]
+                self._scales[row] = self._scales[last]
+                moved = self.images[last]
+                self.images[row] = moved
+                self._rows[moved] = row
+            self.images.pop()
+            self._count -= 1
+
+    @property
+    def size(self) -> int:
+        return self._count
+
     def load_users(self):
         for user_id in os.listdir(self.db_path):
             self.load_user(user_id)
@@ -86,9 +158,7 @@ class FeatureDB:
             key = os.path.splitext(os.path.basename(image_file))[0]
             feature_file = image_file.replace(".jpg", ".npy")
             if os.path.exists(feature_file):
-                self.images.append(key)
-                self.features.append(np.load(feature_file))
-                self.mapper[key] = user_id
+                self._add_feature(key, np.load(feature_file), user_id)
 
     def show_users_faces(self):
         users = defaultdict(list)
@@ -132,7 +202,9 @@ class FeatureDB:
         return True
 
     def delete_user_faces(self, user_id: str, face_key: str):
-        del self.mapper[face_key]
+        if face_key not in self.mapper:
+            raise KeyError(face_key)
+        self._remove_feature(face_key)
         # 删除key对应的文件
         os.remove(os.path.join(self.db_path, user_id, face_key + ".jpg"))
         os.remove(os.path.join(self.db_path, user_id, face_key + ".npy"))
@@ -154,7 +226,7 @@ class FeatureDB:
                 image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
                 # 向量数据
                 vector_resp = requests.get(face["vector"])
-                vector = np.array(np.frombuffer(vector_resp.content))
+                vector = self.parse_vector(vector_resp.content)
             except Exception as e:
                 logger.error(f"update user {user_id} face {face_key} error {e}!")
             else:
@@ -164,21 +236,28 @@ class FeatureDB:
         if user_id in self.user_ids:
             faces = [key for key, value in self.mapper.items() if value == user_id]
             for face in faces:
-                del self.mapper[face]
+                self._remove_feature(face)
             shutil.rmtree(os.path.join(self.db_path, user_id))
 
         return True
 
     def compare(self, feature: np.ndarray, sim_threshold: float = None):
-        if len(self.features) == 0:
+        # 先读取数量再切片, 与并发的添加互不影响
+        count = self._count
+        if count == 0:
             return None
         sim_thresh = sim_threshold if sim_threshold else self.sim_threshold
 
-        index_cossims = self.cosine_similarity(feature, np.vstack(self.features).T)[0]
+        query = np.asarray(feature, dtype=np.float32).reshape(1, -1)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        # 特征库已归一化, 按存储精度比较
+        index_cossims = dot(query, self._codes[:count], self._scales[:count])[0]
         # 找出最大的相似度
-        s = np.argmax(index_cossims)
+        s = int(np.argmax(index_cossims))
         if index_cossims[s] > sim_thresh:
-            max_similar_key = self.images[s]
+            images = self.images
+            # 比较期间可能有特征被删除
+            max_similar_key = images[s] if s < len(images) else None
             # 找出最大相似度的索引, 根据索引获取用户ID
             user_id = self.mapper.get(max_similar_key, None)
             return user_id
@@ -230,9 +309,8 @@ class FeatureDB:
             return
 
         key = face_key if face_key else str(uuid4())[:8]
-        self.images.append(key)
-        self.features.append(feature)
-        self.mapper[key] = user_id
+        feature = np.asarray(feature, dtype=np.float32)
+        self._add_feature(key, feature, user_id)
 
         logger.info(f"save user {user_id} face {key} to {user_dir}")
 
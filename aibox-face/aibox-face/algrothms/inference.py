@@ -60,7 +60,7 @@ class Inference:
                 xmin, ymin, xmax, ymax = det
                 face_img = F.norm_crop(image, np.array(kps))
                 # 正常模式下，如果背景特征库为空时，不调用特征匹配
-                if len(self.featuredb.features) == 0 and not is_record:
+                if self.featuredb.size == 0 and not is_record:
                     user_id = "UNKNOWN"
                 else:
                     user_id = self.featuredb.predict(face_img, is_record)
@@ -0,0 +1,64 @@
+"""
+特征低精度存储
+
+float32: 原始精度
+float16: 半精度, 内存减半, 相似度误差约 1e-3
+int8: 每个特征按最大绝对值缩放到 [-127, 127], 另存一个 float32 缩放系数, 内存约为 1/4
+
+numpy 没有 float16/int8 的矩阵乘法加速，比较时按块转换为 float32 后再做矩阵乘法，
+每块的数据量不超过 CPU 缓存，内存读取量随存储精度减少
+"""
+
+from typing import Tuple
+
+import numpy as np
+
+PRECISIONS = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+
+# 分块比较时每块的特征数量
+BLOCK_ROWS = 1024
+
+
+def check_precision(precision: str) -> np.dtype:
+    if precision not in PRECISIONS:
+        raise ValueError(f"未知的特征存储精度: {precision}")
+    return np.dtype(PRECISIONS[precision])
+
+
+def quantize(features: np.ndarray, dtype: np.dtype) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    :param features: (n, D) float32 特征
+    :return: (存储精度的特征, (n,) 缩放系数)
+    """
+    features = np.asarray(features, dtype=np.float32)
+    if dtype == np.int8:
+        scales = np.abs(features).max(axis=1) / 127
+        scales[scales == 0] = 1
+        codes = np.rint(features / scales[:, None]).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    return features.astype(dtype), np.ones(len(features), dtype=np.float32)
+
+
+def dequantize(codes: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    features = codes.astype(np.float32)
+    if codes.dtype == np.int8:
+        features *= scales[:, None]
+    return features
+
+
+def dot(queries: np.ndarray, codes: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    """
+    :param queries: (n, D) float32 特征
+    :param codes: (N, D) 存储精度的特征
+    :param scales: (N,) 缩放系数
+    :return: (n, N) float32 内积
+    """
+    if codes.dtype == np.float32:
+        return queries @ codes.T
+    sims = np.empty((len(queries), len(codes)), dtype=np.float32)
+    for start in range(0, len(codes), BLOCK_ROWS):
+        block = codes[start : start + BLOCK_ROWS].astype(np.float32)
+        sims[:, start : start + len(block)] = queries @ block.T
+    if codes.dtype == np.int8:
+        sims *= scales[None, :]
+    return sims
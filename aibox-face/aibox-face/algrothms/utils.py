@@ -42,16 +42,23 @@ def draw_mask(frame: np.ndarray, points: List[List[int]]):
 
 
 def draw_image_with_boxes(
-    image: np.ndarray, objects: List[ObjectPayload], delay_time: float, fps: int
+    image: np.ndarray,
+    objects: List[ObjectPayload],
+    delay_time: float,
+    fps: int,
+    scale: float = 1.0,
 ):
-    # 基于objects的box和label在图像上画对应的框和prob 标记
+    # 基于objects的box和label在图像上画对应的框和prob 标记, scale 为图像相对box坐标的缩放比例
     def _draw(
         image: np.ndarray,
         object: ObjectPayload,
         box_color=(0, 255, 0),
         label_color=(0, 0, 255),
     ):
-        x1, y1, x2, y2 = object.box.x1, object.box.y1, object.box.x2, object.box.y2
+        x1, y1, x2, y2 = [
+            int(v * scale)
+            for v in (object.box.x1, object.box.y1, object.box.x2, object.box.y2)
+        ]
         cv2.rectangle(image, (x1, y1), (x2, y2), box_color, 2)
         cv2.putText(
             image,
@@ -1,5 +1,5 @@
 import math
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Tuple
 
 from coral import (
     CoralNode,
@@ -10,6 +10,7 @@ from coral import (
     RawPayload,
     ObjectPayload,
 )
+from coral.types.payload import Box
 
 import web
 from algrothms.gossip import GossipCommunicate
@@ -38,6 +39,8 @@ class AIboxFace(CoralNode):
         # 更新node_id变量，并启动web服务
         web.node_id = self.config.node_id
         web.async_run(self.config.node_id, self.params.featuredb.db_path)
+        # 各摄像头最近一次的识别结果, (人物框列表, 对应的人脸结果列表)
+        self.last_results: Dict[str, Tuple[List[Box], List[Any]]] = {}
 
     def init(self, index: int, context: dict):
         """
@@ -57,6 +60,7 @@ class AIboxFace(CoralNode):
             db_path=feat_params.db_path,
             user_faces_size=feat_params.user_faces_size,
             sim_threshold=feat_params.sim_threshold,
+            precision=feat_params.precision,
         )
         inference = Inference(
             featuredb=featuredb,
@@ -108,18 +112,34 @@ class AIboxFace(CoralNode):
         if self.params.is_open:
             raw = payload.raw
             model: Inference = context["model"]
-            for object in payload.objects:
-                box = object.box
-                face_raw = raw[box.x1 : box.x2 + 1, box.y1 : box.y2 + 1, :]
-                face_objects = model.predict(face_raw, box, self.params.is_record)
-                similar_face_object = self.get_max_face(face_objects)
-                if similar_face_object:
-                    object.objects = [ObjectPayload(**similar_face_object)]
-
-        # 传输当前RawPayload的复制对象到frames_queue中，供web页面展示
-        web.append_payload_to_web_queue(
-            payload.model_copy(deep=True), math.ceil(self.sender_fps)
-        )
+            boxes = [object.box for object in payload.objects]
+            stats = web.motion_stats[payload.source_id]
+            stats["frames"] += 1
+            # 画面未变化且人物框与上一次一致时，复用上一次的人脸识别结果
+            motion = payload.raw_params.get("motion")
+            last_boxes, last_faces = self.last_results.get(
+                payload.source_id, (None, None)
+            )
+            if motion and not motion["changed"] and last_boxes == boxes:
+                stats["skipped"] += 1
+                for object, faces in zip(payload.objects, last_faces):
+                    object.objects = faces
+            else:
+                for object in payload.objects:
+                    box = object.box
+                    face_raw = raw[box.x1 : box.x2 + 1, box.y1 : box.y2 + 1, :]
+                    face_objects = model.predict(face_raw, box, self.params.is_record)
+                    similar_face_object = self.get_max_face(face_objects)
+                    if similar_face_object:
+                        object.objects = [ObjectPayload(**similar_face_object)]
+                self.last_results[payload.source_id] = (
+                    boxes,
+                    [object.objects for object in payload.objects],
+                )
+
+        # 有预览连接时才传输当前RawPayload的复制对象，供web页面展示
+        if web.preview_wanted(payload.source_id):
+            web.append_payload_to_web_queue(payload, math.ceil(self.sender_fps))
 
         return ObjectsPayload(objects=payload.objects, mode=InterfaceMode.OVERWRITE)
 
@@ -70,6 +70,10 @@ class FeatureDBParamsModel(ModelParamsModel):
     base_dir: str = "db/face"
     user_faces_size: int = 10
     sim_threshold: float = 0.9
+    precision: str = Field(
+        default="float32",
+        description="内存中特征的存储精度, float32, float16 或 int8(每个特征一个缩放系数)",
+    )
 
     @property
     def db_path(self):
@@ -117,6 +121,10 @@ class WebFeatureDBParams(BaseModel):
     height: int
     user_faces_size: int = 10
     sim_threshold: float = 0.9
+    precision: str = Field(
+        default="float32",
+        description="内存中特征的存储精度, float32, float16 或 int8(每个特征一个缩放系数)",
+    )
 
 
 class WebNodeParams(BaseModel):
@@ -1,8 +1,9 @@
 import os
 import time
+import asyncio
 import json
 import shutil
-from typing import Dict
+from typing import Dict, Set
 from threading import Thread
 from collections import deque, defaultdict
 from urllib.parse import urljoin
@@ -14,12 +15,13 @@ import uvicorn
 import numpy as np
 from loguru import logger
 from coral import RawPayload
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, Request
 from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 
 from algrothms.inference import Inference
 from algrothms.gossip import GossipCommunicate
+from algrothms.broadcast import PayloadBroadcaster
 from algrothms.utils import draw_image_with_boxes, draw_mask
 from schema import (
     RecordFeatureModel,
@@ -31,8 +33,15 @@ from schema import (
 # 全局变量
 node_id = None
 contexts = {}
-stop_stream = False
-cameras_queue: Dict[str, deque] = defaultdict(lambda: deque(maxlen=5))
+# 每个预览连接的停止事件，按摄像头分组
+stream_stops: Dict[str, Set[asyncio.Event]] = defaultdict(set)
+# 预览帧率
+preview_fps = 15
+broadcasters: Dict[str, PayloadBroadcaster] = defaultdict(PayloadBroadcaster)
+# 画面变化检测的跳帧统计, 摄像头ID -> {"frames": 总帧数, "skipped": 复用结果的帧数}
+motion_stats: Dict[str, Dict[str, int]] = defaultdict(
+    lambda: {"frames": 0, "skipped": 0}
+)
 
 
 """
@@ -90,8 +99,52 @@ def check_config_fp_or_set_default(config_fp: str):
             )
 
 
+def preview_wanted(camera_id: str) -> bool:
+    """仅在有预览连接时按预览帧率取帧，无人观看时不产生任何拷贝"""
+    broadcaster = broadcasters.get(camera_id)
+    return broadcaster is not None and broadcaster.wants_frame(preview_fps)
+
+
 def append_payload_to_web_queue(payload: RawPayload, fps: int) -> None:
-    cameras_queue[payload.source_id].append((payload, fps))
+    # 只拷贝缩放到预览分辨率的画面及识别结果
+    frame: np.ndarray = payload.raw
+    camera_height = payload.raw_params.get("camera_height", None)
+    scale = camera_height / frame.shape[0] if camera_height else 1.0
+    if scale != 1.0:
+        oh, ow = frame.shape[:2]
+        preview = cv2.resize(frame, (int(ow * scale), int(camera_height)))
+    else:
+        preview = frame.copy()
+    preview_payload = payload.model_copy(
+        update={
+            "raw": preview,
+            "objects": [object.model_copy(deep=True) for object in payload.objects],
+        }
+    )
+    broadcasters[payload.source_id].publish((preview_payload, fps, scale))
+
+
+def render_payload(message) -> bytes:
+    payload: RawPayload = message[0]
+    fps: int = message[1]
+    # 画面已缩放到预览分辨率, 框和mask坐标需同比例缩放
+    scale: float = message[2]
+    frame: np.ndarray = payload.raw
+
+    draw_image_with_boxes(
+        frame, payload.objects, int(payload.nodes_cost * 1000), fps, scale
+    )
+    # 画mask
+    if payload.raw_params["points"]:
+        points = [
+            [int(x * scale), int(y * scale)] for x, y in payload.raw_params["points"]
+        ]
+        frame = draw_mask(frame, points)
+
+    ret, frame = cv2.imencode(".jpg", frame)
+    if not ret:
+        raise ValueError("图像编码失败！")
+    return frame.tobytes()
 
 
 def durable_config(node_params: dict):
@@ -241,6 +294,11 @@ def record_feature(item: RecordFeatureModel):
     return {"result": "success"}
 
 
+@router.get("/motion/stats")
+def get_motion_stats():
+    return motion_stats
+
+
 @router.get("/config")
 def get_params():
     params = contexts[0]["params"]
@@ -281,55 +339,44 @@ def change_params(item: WebNodeParams):
 
 
 @router.get("/cameras/stop_stream")
-def stop_stream_view():
-    global stop_stream
-    stop_stream = True
+async def stop_stream_view(camera_id: str = None):
+    # 只停止当前已建立的连接，不影响之后新建立的预览
+    camera_ids = [camera_id] if camera_id else list(stream_stops.keys())
+    for _camera_id in camera_ids:
+        for stop in stream_stops.get(_camera_id, ()):
+            stop.set()
     return {"result": "success"}
 
 
 @router.get("/cameras/{camera_id}/stream")
-def get_frames(camera_id: str):
-    global stop_stream
-    stop_stream = False
-
-    def process_frames():
-        while True:
-            try:
-                message = cameras_queue[camera_id].popleft()
-                payload: RawPayload = message[0]
-                fps: int = message[1]
-            except IndexError:
-                # 队列不存在值
-                continue
-
-            if stop_stream:
-                logger.info(f"{camera_id} stop stream!")
-                break
-
-            frame: np.ndarray = payload.raw
-
-            draw_image_with_boxes(
-                frame, payload.objects, int(payload.nodes_cost * 1000), fps
-            )
-            # 画mask
-            if payload.raw_params["points"]:
-                frame = draw_mask(frame, payload.raw_params["points"])
-
-            # 修改分辨率
-            camera_height = payload.raw_params.get("camera_height", None)
-            if camera_height:
-                oh, ow = frame.shape[:2]
-                scale = camera_height / oh
-                frame = cv2.resize(frame, (int(ow * scale), int(camera_height)))
-
-            ret, frame = cv2.imencode(".jpg", frame)
-            if not ret:
-                raise HTTPException(status_code=500, detail="图像编码失败！")
-            bframe = frame.tobytes()
-            yield (
-                b"--frame\r\n"
-                b"Content-Type: image/jpeg\r\n\r\n" + bframe + b"\r\n\r\n"
-            )
+async def get_frames(camera_id: str, request: Request):
+    stop = asyncio.Event()
+    stream_stops[camera_id].add(stop)
+
+    async def process_frames():
+        broadcaster = broadcasters[camera_id]
+        broadcaster.subscribe()
+        seq = 0
+        try:
+            while not stop.is_set():
+                try:
+                    seq, bframe = await broadcaster.get(seq, render_payload)
+                except ValueError as e:
+                    raise HTTPException(status_code=500, detail=str(e))
+                if bframe is None:
+                    # 超时无新帧, 顺便检查连接是否已断开
+                    if await request.is_disconnected():
+                        break
+                    continue
+
+                yield (
+                    b"--frame\r\n"
+                    b"Content-Type: image/jpeg\r\n\r\n" + bframe + b"\r\n\r\n"
+                )
+        finally:
+            broadcaster.unsubscribe()
+            stream_stops[camera_id].discard(stop)
+            logger.info(f"{camera_id} stop stream!")
 
     return StreamingResponse(
         process_frames(), media_type="multipart/x-mixed-replace; boundary=frame"
@@ -0,0 +1,133 @@
+"""
+多摄像头检测批处理，将多个 worker 同时送来的画面合并为一次检测
+"""
+
+import time
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+
+def detect_by_shape(predict: Callable, images: List[np.ndarray]) -> List[Tuple]:
+    """
+    按画面尺寸分组批量检测
+
+    metacv 的 Detection.predict 使用第一张画面的缩放比例还原整批画面的检测框，
+    不同分辨率的摄像头画面或 mask 区域截图需要分开检测
+
+    :param predict: 模型的 predict 方法, 返回 (boxes 列表, scores 列表, labels 列表)
+    :return: 每张画面的 (boxes, scores, labels)
+    """
+    groups: Dict[Tuple[int, ...], List[int]] = {}
+    for idx, image in enumerate(images):
+        groups.setdefault(image.shape, []).append(idx)
+    results: List[Optional[Tuple]] = [None] * len(images)
+    for indices in groups.values():
+        dets, det_scores, det_labels = predict([images[idx] for idx in indices])
+        for idx, result in zip(indices, zip(dets, det_scores, det_labels)):
+            results[idx] = result
+    return results
+
+
+class _BatchItem:
+    __slots__ = ("image", "ts", "done", "result", "error")
+
+    def __init__(self, image: np.ndarray) -> None:
+        self.image = image
+        self.ts = time.time()
+        self.done = False
+        self.result: Any = None
+        self.error: Optional[Exception] = None
+
+
+class DetectionBatcher:
+    """
+    检测批处理
+
+    各 worker 调用 detect 提交画面后等待结果，没有正在组批的 worker 时由当前 worker 负责组批：
+    凑满 batch_size 帧或最早的一帧等待超过 max_wait_ms 后，使用自己的模型对整批画面检测一次，
+    再把结果分发给各 worker。max_wait_ms 是单帧因组批增加的最大延迟，
+    batch_size 为 1 时不组批
+    """
+
+    def __init__(self, batch_size: int = 1, max_wait_ms: float = 5) -> None:
+        self.batch_size = max(batch_size, 1)
+        self.max_wait = max_wait_ms / 1000
+        self._cond = threading.Condition()
+        self._pending: List[_BatchItem] = []
+        self._leader = False
+        # 批处理统计
+        self.batches = 0
+        self.frames = 0
+
+    def detect(self, model, image: np.ndarray):
+        """
+        检测单帧画面
+
+        :param model: Inference 实例, 组批的 worker 使用自己的模型检测整批画面
+        :param image: 画面
+        :return: (boxes, scores, labels)
+        """
+        if self.batch_size == 1:
+            result = model.detect([image])[0]
+            with self._cond:
+                self.batches += 1
+                self.frames += 1
+            return result
+
+        item = _BatchItem(image)
+        with self._cond:
+            self._pending.append(item)
+            self._cond.notify_all()
+            while not item.done:
+                if self._leader:
+                    self._cond.wait()
+                    continue
+                self._lead(model)
+
+        if item.error is not None:
+            raise item.error
+        return item.result
+
+    def _lead(self, model) -> None:
+        """组批并检测，调用时持有锁，检测期间释放锁"""
+        self._leader = True
+        while len(self._pending) < self.batch_size:
+            remaining = self._pending[0].ts + self.max_wait - time.time()
+            if remaining <= 0:
+                break
+            self._cond.wait(remaining)
+        batch = self._pending[: self.batch_size]
+        del self._pending[: self.batch_size]
+
+        self._cond.release()
+        results, error = None, None
+        try:
+            results = model.detect([item.image for item in batch])
+        except Exception as e:
+            logger.exception(f"batch detect error: {e}")
+            error = e
+        finally:
+            self._cond.acquire()
+
+        for idx, item in enumerate(batch):
+            item.error = error
+            item.result = results[idx] if results is not None else None
+            item.done = True
+        self.batches += 1
+        self.frames += len(batch)
+        self._leader = False
+        self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            batches, frames = self.batches, self.frames
+        return {
+            "batch_size": self.batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "batches": batches,
+            "frames": frames,
+            "avg_batch": round(frames / batches, 3) if batches else 0,
+        }
@@ -1,84 +1,409 @@
 import os
 import time
 import platform
+import threading
+from typing import Dict, List, Optional, Tuple
 
 import cv2
 import numpy as np
 from loguru import logger
 
+from .index import FlatIndex, create_index
+from .quantize import check_precision, dequantize, dot, quantize
+from .storage import FileStorage, create_storage
 from .utils import get_import_meta
+from .writer import FeatureWriter
 
 
 class FeatureData:
-    def __init__(self, data: dict, db_path: str, db_size_threshold: int):
+    """
+    特征库
+
+    特征归一化后按行保存在连续的 float32 矩阵中，比较时直接与矩阵做一次矩阵乘法；
+    矩阵容量按倍数扩容，删除时用最后一行填补被删除的行。
+    特征库较大时可使用 ivf 索引近似检索。
+    新增及删除立即作用于内存中的特征库，图片及特征文件由后台线程写盘，
+    文件存储方式见 storage 模块。
+
+    容量策略:
+    evict_policy: 特征库已满时的处理方式, none 不再添加, lru 删除最久未匹配的样本(从未匹配的
+        按记录时间), least_matched 删除匹配次数最少的样本
+    max_age_days: 超过该天数未匹配的样本被删除, 为 0 时不删除
+    merge_threshold: 新样本与已有样本相似度不低于该值时合并到已有样本(特征取平均), 为 0 时不合并
+    匹配次数及最近匹配时间只保存在内存中, 重启后从记录时间开始计算
+
+    precision: 内存中特征矩阵的存储精度 float32/float16/int8, 见 quantize 模块,
+        文件中的特征始终为 float32
+    """
+
+    # 过期检查的最小间隔(秒)
+    expire_interval = 60
+
+    def __init__(
+        self,
+        data: dict,
+        db_path: str,
+        db_size_threshold: int,
+        index_type: str = "flat",
+        index_params: Optional[dict] = None,
+        write_queue_size: int = 256,
+        storage: Optional[FileStorage] = None,
+        evict_policy: str = "none",
+        max_age_days: float = 0,
+        merge_threshold: float = 0,
+        precision: str = "float32",
+    ):
+        self.dtype = check_precision(precision)
+        if evict_policy not in ("none", "lru", "least_matched"):
+            raise ValueError(f"未知的特征库淘汰策略: {evict_policy}")
         self.db_size_threshold = db_size_threshold
         self.db_path = db_path
-        self._data = data
+        self.evict_policy = evict_policy
+        self.max_age = max_age_days * 86400
+        self.merge_threshold = merge_threshold
+        self.storage = storage or FileStorage(db_path)
+        self.writer = FeatureWriter(self.storage, max_queue=write_queue_size)
+        self._lock = threading.Lock()
+        self._matrix: Optional[np.ndarray] = None
+        self._count = 0
+        # 行号 -> key, key -> 行号
+        self._keys: List[str] = []
+        self._rows: Dict[str, int] = {}
+        # 与特征矩阵各行对应的记录时间、最近匹配时间、匹配次数及合并的样本数
+        self._added = np.empty(0, dtype=np.float64)
+        self._last_hit = np.empty(0, dtype=np.float64)
+        self._hits = np.empty(0, dtype=np.int64)
+        self._samples = np.empty(0, dtype=np.int64)
+        # 各行特征的缩放系数, 仅 int8 精度使用
+        self._scales = np.empty(0, dtype=np.float32)
+        self._last_expire = 0.0
+        # 淘汰、过期删除及合并的样本数
+        self.evicted = 0
+        self.expired = 0
+        self.merged = 0
+        self.index: Optional[FlatIndex] = None
+        if data:
+            self._load(data)
+        # 加载完特征后再建立索引
+        self.index = create_index(self, index_type, **(index_params or {}))
+        self.index.build()
 
     @classmethod
     def filter_files(cls, dir: str, suffix: str):
         return [os.path.join(dir, f) for f in os.listdir(dir) if f.endswith(suffix)]
 
     @classmethod
-    def load(cls, db_path: str, db_size_threshold: int):
+    def load(
+        cls,
+        db_path: str,
+        db_size_threshold: int,
+        index_type: str = "flat",
+        index_params: Optional[dict] = None,
+        write_queue_size: int = 256,
+        storage_type: str = "files",
+        evict_policy: str = "none",
+        max_age_days: float = 0,
+        merge_threshold: float = 0,
+        precision: str = "float32",
+    ):
         # 创建文件夹
         if not os.path.exists(db_path):
             os.makedirs(db_path, mode=774, exist_ok=True)
 
-        data = {}
-        image_files = cls.filter_files(db_path, ".jpg")
-        # for循环每个image，替换jpg为npy，判断是否存在该文件
-        for image_file in image_files:
-            key = os.path.splitext(os.path.basename(image_file))[0]
-            feature_file = image_file.replace(".jpg", ".npy")
-            if os.path.exists(feature_file):
-                try:
-                    data[key] = np.load(feature_file)
-                except Exception as e:
-                    logger.warning(f"load feature {key} error: {e}")
-
-        logger.info(
-            f"load {len(image_files)} images from {db_path}, init data size: {len(data)}"
+        storage = create_storage(db_path, storage_type)
+        data = storage.load()
+        return cls(
+            data,
+            db_path,
+            db_size_threshold,
+            index_type,
+            index_params,
+            write_queue_size,
+            storage,
+            evict_policy,
+            max_age_days,
+            merge_threshold,
+            precision,
         )
-        return cls(data, db_path, db_size_threshold)
+
+    @classmethod
+    def normalize(cls, feature: np.ndarray) -> np.ndarray:
+        feature = np.asarray(feature, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(feature)
+        return feature / norm if norm > 0 else feature
+
+    def _append(self, key: str, feature: np.ndarray, ts: Optional[float] = None):
+        feature = self.normalize(feature)
+        if key in self._rows:
+            row = self._rows[key]
+            self._store(row, feature)
+            if self.index:
+                self.index.add(row, feature)
+            return
+        if self._matrix is None:
+            self._matrix = np.empty((16, feature.shape[0]), dtype=self.dtype)
+        elif self._count == len(self._matrix):
+            # 容量不足时翻倍扩容，均摊后每次添加为 O(D)
+            matrix = np.empty(
+                (len(self._matrix) * 2, self._matrix.shape[1]), self.dtype
+            )
+            matrix[: self._count] = self._matrix[: self._count]
+            self._matrix = matrix
+        if len(self._hits) < len(self._matrix):
+            self._grow_meta(len(self._matrix))
+        ts = time.time() if ts is None else ts
+        self._added[self._count] = ts
+        self._last_hit[self._count] = ts
+        self._hits[self._count] = 0
+        self._samples[self._count] = 1
+        self._store(self._count, feature)
+        self._rows[key] = self._count
+        self._keys.append(key)
+        self._count += 1
+        if self.index:
+            self.index.add(self._count - 1, feature)
+
+    def _load(self, data: Dict[str, np.ndarray]) -> None:
+        """加载时一次完成所有特征的归一化及量化"""
+        keys = list(data)
+        n = len(keys)
+        features = np.array([data[key] for key in keys], dtype=np.float32)
+        features = features.reshape(n, -1)
+        norms = np.linalg.norm(features, axis=1, keepdims=True)
+        codes, scales = quantize(features / np.where(norms > 0, norms, 1), self.dtype)
+        now = time.time()
+        timestamps = [self.storage.timestamp(key) for key in keys]
+        timestamps = np.array([now if ts is None else ts for ts in timestamps])
+
+        capacity = max(16, 1 << (n - 1).bit_length())
+        self._matrix = np.empty((capacity, codes.shape[1]), dtype=self.dtype)
+        self._matrix[:n] = codes
+        self._grow_meta(capacity)
+        self._scales[:n] = scales
+        self._added[:n] = timestamps
+        self._last_hit[:n] = timestamps
+        self._samples[:n] = 1
+        self._keys = keys
+        self._rows = {key: row for row, key in enumerate(keys)}
+        self._count = n
+
+    def _remove(self, key: str) -> None:
+        row = self._rows.pop(key, None)
+        if row is None:
+            return
+        if self.index:
+            self.index.remove(row)
+        last = self._count - 1
+        if row != last:
+            # 最后一行移动到被删除的行
+            self._matrix[row] = self._matrix[last]
+            for meta in (
+                self._added,
+                self._last_hit,
+                self._hits,
+                self._samples,
+                self._scales,
+            ):
+                meta[row] = meta[last]
+            moved = self._keys[last]
+            self._keys[row] = moved
+            self._rows[moved] = row
+            if self.index:
+                self.index.move(last, row)
+        self._keys.pop()
+        self._count -= 1
+
+    def _grow_meta(self, capacity: int) -> None:
+        def grow(meta: np.ndarray) -> np.ndarray:
+            new = np.zeros(capacity, dtype=meta.dtype)
+            new[: len(meta)] = meta
+            return new
+
+        self._added = grow(self._added)
+        self._last_hit = grow(self._last_hit)
+        self._hits = grow(self._hits)
+        self._samples = grow(self._samples)
+        self._scales = grow(self._scales)
+
+    def _store(self, row: int, feature: np.ndarray) -> None:
+        codes, scales = quantize(feature[None, :], self.dtype)
+        self._matrix[row] = codes[0]
+        self._scales[row] = scales[0]
+
+    def _row(self, row: int) -> np.ndarray:
+        return dequantize(self._matrix[row : row + 1], self._scales[row : row + 1])[0]
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """(size, D) 的归一化 float32 特征矩阵, 低精度存储时为转换后的副本"""
+        if self._matrix is None:
+            return np.empty((0, 0), dtype=np.float32)
+        if self.dtype == np.float32:
+            return self._matrix[: self._count]
+        return dequantize(self._matrix[: self._count], self._scales[: self._count])
+
+    def dot(self, queries: np.ndarray) -> np.ndarray:
+        """(n, D) 的归一化特征与特征库所有特征的相似度, 返回 (n, size)"""
+        if self._matrix is None:
+            return np.zeros((len(queries), 0), dtype=np.float32)
+        count = self._count
+        return dot(queries, self._matrix[:count], self._scales[:count])
+
+    @property
+    def lock(self) -> threading.Lock:
+        """修改特征矩阵时持有的锁, 索引根据特征矩阵重建时也需要持有"""
+        return self._lock
+
+    @property
+    def keys(self) -> List[str]:
+        return list(self._keys)
 
     @property
     def data(self):
-        return self._data
+        return {key: self._row(row) for key, row in self._rows.items()}
 
     @property
     def size(self):
-        return len(self.data)
+        return self._count
+
+    def search(
+        self, queries: np.ndarray, threshold: float
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """返回 (每个特征的最大相似度, 超过阈值的特征库数量), 并记录匹配到的样本"""
+        max_sims, above_counts, best_rows = self.index.search(queries, threshold)
+        matched = best_rows[(above_counts > 0) & (best_rows >= 0)]
+        if len(matched):
+            now = time.time()
+            with self._lock:
+                # 检索期间可能有样本被删除
+                matched = matched[matched < self._count]
+                np.add.at(self._hits, matched, 1)
+                self._last_hit[matched] = now
+        self.expire()
+        return max_sims, above_counts
 
     def add(self, key: str, image: np.ndarray, feature: np.ndarray):
-        if self.size > self.db_size_threshold:
+        if self.evict_policy == "none" and self.size > self.db_size_threshold:
             logger.info(
                 f"db has more than {self.db_size_threshold} fake persons, skip add!!!"
             )
             return
 
-        self._data[key] = feature
-        # 持久化
-        cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 100])[1].tofile(
-            os.path.join(self.db_path, key + ".jpg")
-        )
-        np.save(os.path.join(self.db_path, key + ".npy"), feature)
+        normalized = self.normalize(feature)
+        merged_key, merged_feature = None, None
+        evicted = []
+        with self._lock:
+            if self.merge_threshold > 0 and self._count:
+                sims, _, rows = self.index.search(
+                    normalized[None, :], self.merge_threshold
+                )
+                if rows[0] >= 0 and sims[0] >= self.merge_threshold:
+                    merged_key, merged_feature = self._merge_locked(
+                        int(rows[0]), normalized
+                    )
+            if merged_key is None:
+                # 淘汰策略为 none 时由开头的检查拒绝新样本, 否则保持特征库数量不超过 db_size_threshold
+                while (
+                    self.evict_policy != "none"
+                    and self._count
+                    and self._count >= self.db_size_threshold
+                ):
+                    evicted.append(self._evict_locked())
+                self._append(key, feature)
+
+        for evicted_key in evicted:
+            self.writer.delete(evicted_key)
+        if merged_key is not None:
+            self.writer.update(merged_key, merged_feature)
+        else:
+            # 持久化, 图像可能是原始画面的切片, 拷贝后再交给写盘线程
+            self.writer.save(key, image.copy(), feature)
+
+    def _merge_locked(self, row: int, feature: np.ndarray) -> Tuple[str, np.ndarray]:
+        """新样本合并到第 row 行样本, 特征取所有合并样本的平均值"""
+        samples = self._samples[row]
+        merged = self.normalize(self._row(row) * samples + feature)
+        key = self._keys[row]
+        self._store(row, merged)
+        self.index.add(row, merged)
+        self._samples[row] = samples + 1
+        self._hits[row] += 1
+        self._last_hit[row] = time.time()
+        self.merged += 1
+        return key, merged.reshape(1, -1)
+
+    def _evict_locked(self) -> str:
+        count = self._count
+        if self.evict_policy == "least_matched":
+            # 匹配次数相同时删除最久未匹配的
+            row = int(np.lexsort((self._last_hit[:count], self._hits[:count]))[0])
+        else:
+            row = int(np.argmin(self._last_hit[:count]))
+        key = self._keys[row]
+        self._remove(key)
+        self.evicted += 1
+        return key
+
+    def expire(self, force: bool = False) -> List[str]:
+        """删除超过 max_age_days 未匹配的样本"""
+        if self.max_age <= 0:
+            return []
+        now = time.time()
+        with self._lock:
+            if not force and now - self._last_expire < self.expire_interval:
+                return []
+            self._last_expire = now
+            rows = np.flatnonzero(now - self._last_hit[: self._count] > self.max_age)
+            keys = [self._keys[row] for row in rows]
+            for key in keys:
+                self._remove(key)
+            self.expired += len(keys)
+        for key in keys:
+            self.writer.delete(key)
+        if keys:
+            logger.info(f"expire {len(keys)} fake persons")
+        return keys
 
     def delete(self, key: str):
-        if key in self.data:
-            del self._data[key]
+        with self._lock:
+            self._remove(key)
         # 删除
-        try:
-            os.remove(os.path.join(self.db_path, key + ".jpg"))
-            os.remove(os.path.join(self.db_path, key + ".npy"))
-        except Exception as e:
-            logger.warning(f"delete feature {key} error: {e}")
+        self.writer.delete(key)
 
     def prune(self):
-        keys = list(self.data.keys())
-        for key in keys:
+        for key in self.keys:
             self.delete(key)
 
+    def close(self, timeout: float = 10) -> None:
+        """退出前等待写盘队列中的任务完成, 未写完的样本重启后丢失"""
+        if not self.writer.flush(timeout):
+            logger.warning(
+                f"featuredb writer not finished in {timeout}s, {self.writer.stats()}"
+            )
+        self.writer.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            count = self._count
+            hits = self._hits[:count]
+            return {
+                "size": count,
+                "db_size_threshold": self.db_size_threshold,
+                "evict_policy": self.evict_policy,
+                "max_age_days": self.max_age / 86400,
+                "merge_threshold": self.merge_threshold,
+                "evicted": self.evicted,
+                "expired": self.expired,
+                "merged": self.merged,
+                "hits": int(hits.sum()),
+                "matched_entries": int(np.count_nonzero(hits)),
+                "merged_samples": int(self._samples[:count].sum() - count),
+                "precision": self.dtype.name,
+                "matrix_bytes": (
+                    0 if self._matrix is None else int(self._matrix[:count].nbytes)
+                ),
+            }
+
 
 class FeatureDB:
 
@@ -92,15 +417,21 @@ class FeatureDB:
         db_instance: FeatureData,
         use_preprocess: bool = True,
         sim_threshold: float = 0.9,
+        batch_size: int = 32,
     ):
         meta = get_import_meta(model_type)
+        self.width = width
+        self.height = height
+        self.swap = None if model_type == "rknn" else (2, 0, 1)
+        # 预处理由 preprocess 批量完成，模型只做推理
+        self.use_preprocess = use_preprocess
         self.model = meta.Classification(
             model_path=weight_path,
             input_height=height,
             input_width=width,
-            use_preprocess=use_preprocess,
+            use_preprocess=False,
             device_id=device_id,
-            swap=None if model_type == "rknn" else (2, 0, 1),
+            swap=self.swap,
         )
         if platform.machine() == "x86_64" and model_type == "rknn":
             self.model.convert_and_load(
@@ -115,6 +446,12 @@ class FeatureDB:
         self.sim_threshold = sim_threshold
 
         self.db_instance = db_instance
+        # 单次推理的最大批大小
+        self.batch_size = max(batch_size, 1)
+        # 模型不支持动态 batch 时退化为逐张推理
+        self._batch_supported = True
+        # 预分配的模型输入，按需扩容
+        self._input: Optional[np.ndarray] = None
 
     @classmethod
     def cosine_similarity(self, a, b):
@@ -126,41 +463,114 @@ class FeatureDB:
         return similarity
 
     def get_fake_person_ids(self):
-        return list(self.db_instance.data.keys())
+        return self.db_instance.keys
 
     def delete_fake_person(self, person_id: str):
         self.db_instance.delete(person_id)
 
-    def compare(self, feature: np.ndarray):
+    def preprocess(self, images: List[np.ndarray]) -> np.ndarray:
+        """将所有图像缩放后写入预分配的输入张量"""
+        n = len(images)
+        if self._input is None or len(self._input) < n:
+            shape = (self.height, self.width, 3)
+            if self.swap:
+                shape = tuple(shape[i] for i in self.swap)
+            self._input = np.empty((max(n, self.batch_size),) + shape, np.float32)
+        for idx, image in enumerate(images):
+            if self.use_preprocess:
+                image = cv2.resize(image, (self.width, self.height))
+            self._input[idx] = image.transpose(self.swap) if self.swap else image
+        return self._input[:n]
+
+    def features(self, images: List[np.ndarray]) -> np.ndarray:
+        """
+        批量提取特征
+
+        :param images: 图像列表
+        :return: (n, D) 的特征矩阵
+        """
+        outputs = []
+        for start in range(0, len(images), self.batch_size):
+            chunk = images[start : start + self.batch_size]
+            batch = self.preprocess(chunk)
+            if self._batch_supported or len(chunk) == 1:
+                try:
+                    feature = np.asarray(self.model.feature(list(batch)))
+                    # 只支持单张输入的模型对多张输入也只返回一行, 特征维度能整除时
+                    # reshape 不会报错, 需检查行数
+                    if len(chunk) > 1 and (
+                        feature.ndim < 2 or feature.shape[-2] != len(chunk)
+                    ):
+                        raise ValueError(
+                            f"feature output shape {feature.shape} not match batch size {len(chunk)}"
+                        )
+                    outputs.append(feature.reshape(len(chunk), -1))
+                    continue
+                except Exception as e:
+                    if len(chunk) == 1:
+                        raise
+                    logger.warning(
+                        f"feature model does not support batch input, fallback: {e}"
+                    )
+                    self._batch_supported = False
+            for image in batch:
+                feature = self.model.feature([image])
+                outputs.append(np.asarray(feature).reshape(1, -1))
+        return np.vstack(outputs)
+
+    def compare_batch(self, features: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        所有特征一次与特征库比较
+
+        :param features: (n, D) 的特征矩阵
+        :return: (是否匹配, 超过阈值的特征库数量)
+        """
+        n = len(features)
         if self.db_instance.size == 0:
-            return False, 0
-
-        index_cossims = self.cosine_similarity(
-            feature, np.vstack(list(self.db_instance.data.values())).T
-        )[0]
-        s = np.argmax(index_cossims)
-        above_threshold_indices = np.where(index_cossims > self.sim_threshold)[0]
-        if index_cossims[s] > self.sim_threshold:
+            return np.zeros(n, dtype=bool), np.zeros(n, dtype=int)
+
+        # 特征库矩阵已归一化且常驻内存，由索引完成检索
+        features = np.asarray(features, dtype=np.float32)
+        features = features / np.linalg.norm(features, axis=1, keepdims=True)
+        max_sims, above_counts = self.db_instance.search(features, self.sim_threshold)
+        matched = above_counts > 0
+        for idx in np.flatnonzero(matched):
             logger.warning(
-                f"matched fake person threshold: {index_cossims[s]} above max threshold {self.sim_threshold}"
+                f"matched fake person threshold: {max_sims[idx]} above max threshold {self.sim_threshold}"
             )
-            return True, len(above_threshold_indices)
+        return matched, above_counts
 
-        return False, 0
+    def compare(self, feature: np.ndarray):
+        matched, above_counts = self.compare_batch(feature.reshape(1, -1))
+        return bool(matched[0]), int(above_counts[0])
 
-    def predict(self, image: np.ndarray, save: bool = False) -> bool:
+    def predict_batch(self, images: List[np.ndarray], save: bool = False) -> List[bool]:
+        """
+        批量判断图像是否为真实人物
+
+        :param images: 人物截图列表
+        :param save: 是否将特征加入特征库
+        :return: 每张图像是否为真实人物
+        """
+        if not images:
+            return []
         st = time.time()
-        feature = self.model.feature(image)
+        features = self.features(images)
         et = time.time()
-        matched, above_count = self.compare(feature)
+        matched, above_counts = self.compare_batch(features)
 
         logger.debug(
-            f"predict {matched} cost: {int((et - st) * 1000)} ms, feature compare cost: {int((time.time() - et) * 1000)} ms, feature count: {self.db_instance.size} "
+            f"predict {len(images)} images cost: {int((et - st) * 1000)} ms, feature compare cost: {int((time.time() - et) * 1000)} ms, feature count: {self.db_instance.size} "
         )
 
-        # 需要保存且相似的素材数量不超过10张时再添加，避免加入过多相似的特征
-        if save and above_count < 15:
-            key = str(int(time.time() * 1000000))
-            self.db_instance.add(key, image, feature)
+        if save:
+            ts = int(time.time() * 1000000)
+            for idx, image in enumerate(images):
+                # 需要保存且相似的素材数量不超过10张时再添加，避免加入过多相似的特征
+                if above_counts[idx] < 15:
+                    self.db_instance.add(str(ts + idx), image, features[idx : idx + 1])
+
+        return [not m for m in matched]
 
-        return True if not matched else False
+    def predict(self, image: np.ndarray, save: bool = False) -> bool:
+        return self.predict_batch([image], save)[0]
@@ -0,0 +1,351 @@
+"""
+特征库检索索引
+
+flat: 与特征库全部特征比较，结果精确，适合小规模特征库
+ivf: 倒排索引，特征按 k-means 聚类中心分桶，只与最相近的 nprobe 个桶中的特征比较，
+     适合数万条以上的特征库，结果为近似值
+"""
+
+import os
+import threading
+from typing import List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from .quantize import dot, quantize
+
+
+class FlatIndex:
+    """精确检索"""
+
+    name = "flat"
+
+    def __init__(self, data) -> None:
+        # FeatureData 实例, 特征矩阵已按行归一化
+        self.data = data
+
+    def build(self) -> None:
+        pass
+
+    def add(self, row: int, feature: np.ndarray) -> None:
+        """特征写入矩阵第 row 行后调用"""
+
+    def remove(self, row: int) -> None:
+        """特征库删除第 row 行前调用"""
+
+    def move(self, src: int, dst: int) -> None:
+        """特征库删除时第 src 行被移动到第 dst 行后调用"""
+
+    def search(
+        self, queries: np.ndarray, threshold: float
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        检索
+
+        :param queries: (n, D) 已归一化的特征
+        :param threshold: 相似度阈值
+        :return: (每个特征的最大相似度, 超过阈值的特征库数量, 最相似的特征行号, 没有时为 -1)
+        """
+        # 按特征库的存储精度比较
+        sims = self.data.dot(queries)
+        if not sims.shape[1]:
+            return (
+                np.zeros(len(queries), np.float32),
+                np.zeros(len(queries), int),
+                np.full(len(queries), -1, np.int64),
+            )
+        best_rows = sims.argmax(axis=1)
+        return (
+            sims[np.arange(len(queries)), best_rows],
+            np.count_nonzero(sims > threshold, axis=1),
+            best_rows,
+        )
+
+    def stats(self) -> dict:
+        return {"type": self.name, "size": self.data.size}
+
+
+class _InvertedList:
+    """单个桶中的特征, 按特征库的存储精度连续存储以便直接做矩阵乘法"""
+
+    def __init__(self, vecs: np.ndarray, ids: np.ndarray, dtype=np.float32) -> None:
+        capacity = max(len(vecs) * 2, 16)
+        self.vecs = np.empty((capacity, vecs.shape[1]), dtype=dtype)
+        self.scales = np.empty(capacity, dtype=np.float32)
+        self.ids = np.empty(capacity, dtype=np.int64)
+        self.count = len(vecs)
+        self.vecs[: self.count], self.scales[: self.count] = quantize(vecs, dtype)
+        self.ids[: self.count] = ids
+
+    def append(self, row: int, feature: np.ndarray) -> int:
+        if self.count == len(self.ids):
+            capacity = len(self.ids) * 2
+            vecs = np.empty((capacity, self.vecs.shape[1]), self.vecs.dtype)
+            vecs[: self.count] = self.vecs[: self.count]
+            scales = np.empty(capacity, np.float32)
+            scales[: self.count] = self.scales[: self.count]
+            ids = np.empty(capacity, np.int64)
+            ids[: self.count] = self.ids[: self.count]
+            self.vecs, self.scales, self.ids = vecs, scales, ids
+        codes, scales = quantize(feature[None, :], self.vecs.dtype)
+        self.vecs[self.count] = codes[0]
+        self.scales[self.count] = scales[0]
+        self.ids[self.count] = row
+        self.count += 1
+        return self.count - 1
+
+    def remove(self, pos: int) -> Optional[int]:
+        """删除第 pos 个特征，返回被移动到 pos 的特征行号"""
+        last = self.count - 1
+        moved = None
+        if pos != last:
+            self.vecs[pos] = self.vecs[last]
+            self.scales[pos] = self.scales[last]
+            self.ids[pos] = self.ids[last]
+            moved = int(self.ids[pos])
+        self.count -= 1
+        return moved
+
+
+class IVFIndex(FlatIndex):
+    """
+    倒排索引
+
+    特征库数量达到 min_train_size 后训练聚类中心，各桶的特征单独连续存储，
+    之后新增的特征直接追加到最近的桶；特征库数量翻倍后在后台线程重新训练。
+    聚类中心保存在特征库目录下，重启后无需重新训练
+    """
+
+    name = "ivf"
+    filename = "ivf_index.npz"
+
+    def __init__(
+        self,
+        data,
+        nlist: Optional[int] = None,
+        nprobe: int = 8,
+        min_train_size: int = 5000,
+        iterations: int = 10,
+    ) -> None:
+        super().__init__(data)
+        # 桶数量, 为空时按特征库数量的平方根自动选择
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.iterations = iterations
+        self.centroids: Optional[np.ndarray] = None
+        self.lists: List[_InvertedList] = []
+        # 特征矩阵各行所在的桶及桶内位置, -1 表示未分配
+        self.loc_list = np.empty(0, dtype=np.int32)
+        self.loc_pos = np.empty(0, dtype=np.int32)
+        self.trained_size = 0
+        self._lock = threading.Lock()
+        self._training = False
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.data.db_path, self.filename)
+
+    def build(self) -> None:
+        if self._load():
+            return
+        if self.data.size >= self.min_train_size:
+            self.train()
+
+    def _load(self) -> bool:
+        if not os.path.exists(self.path):
+            return False
+        try:
+            saved = np.load(self.path)
+            centroids = saved["centroids"].astype(np.float32)
+            trained_size = int(saved["trained_size"])
+        except Exception as e:
+            logger.warning(f"load ivf index {self.path} error: {e}")
+            return False
+        matrix = self.data.matrix
+        if len(matrix) and centroids.shape[1] != matrix.shape[1]:
+            logger.warning("ivf index dim not match, retrain")
+            return False
+        self._swap(centroids, trained_size)
+        logger.info(f"load ivf index {len(centroids)} lists from {self.path}")
+        return True
+
+    def _save(self) -> None:
+        tmp = self.path + ".tmp.npz"
+        np.savez(tmp, centroids=self.centroids, trained_size=self.trained_size)
+        os.replace(tmp, self.path)
+
+    def _nlist(self, n: int) -> int:
+        if self.nlist:
+            return self.nlist
+        return int(np.clip(np.sqrt(n), 8, 1024))
+
+    def _kmeans(self, matrix: np.ndarray, nlist: int) -> np.ndarray:
+        """球面 k-means, 样本及聚类中心均为单位向量"""
+        rng = np.random.default_rng(0)
+        # 训练样本数量上限，每个桶约 256 个样本已足够
+        if len(matrix) > nlist * 256:
+            matrix = matrix[rng.choice(len(matrix), nlist * 256, replace=False)]
+        centroids = matrix[rng.choice(len(matrix), nlist, replace=False)].copy()
+        for _ in range(self.iterations):
+            labels = np.argmax(matrix @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, matrix)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # 空桶保留原聚类中心
+            empty = norms[:, 0] == 0
+            sums[empty] = centroids[empty]
+            norms[empty] = 1
+            centroids = sums / norms
+        return centroids.astype(np.float32)
+
+    def train(self) -> None:
+        # 特征库删除时会先后调用 remove、移动矩阵行、move, 持有特征库的锁才能得到一致的快照
+        with self.data.lock:
+            matrix = self.data.matrix.copy()
+        nlist = min(self._nlist(len(matrix)), len(matrix))
+        if nlist < 1:
+            return
+        centroids = self._kmeans(matrix, nlist)
+        self._swap(centroids, len(matrix))
+        try:
+            self._save()
+        except Exception as e:
+            logger.warning(f"save ivf index {self.path} error: {e}")
+        logger.info(f"train ivf index with {len(matrix)} features, {nlist} lists")
+
+    def _train_background(self) -> None:
+        try:
+            self.train()
+        except Exception as e:
+            logger.exception(f"train ivf index error: {e}")
+        finally:
+            self._training = False
+
+    def _ensure_loc(self, size: int) -> None:
+        if size <= len(self.loc_list):
+            return
+        capacity = max(size, len(self.loc_list) * 2, 16)
+        loc_list = np.full(capacity, -1, dtype=np.int32)
+        loc_pos = np.full(capacity, -1, dtype=np.int32)
+        loc_list[: len(self.loc_list)] = self.loc_list
+        loc_pos[: len(self.loc_pos)] = self.loc_pos
+        self.loc_list, self.loc_pos = loc_list, loc_pos
+
+    def _swap(self, centroids: np.ndarray, trained_size: int) -> None:
+        # 同时持有特征库及索引的锁按新的聚类中心重建全部桶，期间的增删操作在锁释放后
+        # 按新的聚类中心处理; 加锁顺序与特征库增删时一致, 先特征库后索引
+        with self.data.lock, self._lock:
+            matrix = self.data.matrix
+            assign = (
+                np.argmax(matrix @ centroids.T, axis=1)
+                if len(matrix)
+                else np.empty(0, dtype=np.int64)
+            )
+            order = np.argsort(assign, kind="stable")
+            bounds = np.searchsorted(assign[order], np.arange(len(centroids) + 1))
+            self.loc_list = np.empty(0, dtype=np.int32)
+            self.loc_pos = np.empty(0, dtype=np.int32)
+            self._ensure_loc(len(matrix))
+            lists = []
+            for idx in range(len(centroids)):
+                rows = order[bounds[idx] : bounds[idx + 1]]
+                lists.append(_InvertedList(matrix[rows], rows, self.data.dtype))
+                self.loc_list[rows] = idx
+                self.loc_pos[rows] = np.arange(len(rows))
+            self.lists = lists
+            self.centroids = centroids
+            self.trained_size = trained_size
+
+    def _remove_locked(self, row: int) -> None:
+        if row >= len(self.loc_list) or self.loc_list[row] < 0:
+            return
+        idx, pos = self.loc_list[row], self.loc_pos[row]
+        moved = self.lists[idx].remove(pos)
+        if moved is not None:
+            self.loc_pos[moved] = pos
+        self.loc_list[row] = -1
+
+    def add(self, row: int, feature: np.ndarray) -> None:
+        with self._lock:
+            if self.centroids is not None:
+                self._ensure_loc(row + 1)
+                # 更新已有特征时先从原来的桶中删除
+                self._remove_locked(row)
+                idx = int(np.argmax(self.centroids @ feature))
+                self.loc_pos[row] = self.lists[idx].append(row, feature)
+                self.loc_list[row] = idx
+            size = self.data.size
+            retrain = not self._training and (
+                (self.centroids is None and size >= self.min_train_size)
+                or (self.centroids is not None and size >= self.trained_size * 2)
+            )
+            if retrain:
+                self._training = True
+        if retrain:
+            threading.Thread(target=self._train_background, daemon=True).start()
+
+    def remove(self, row: int) -> None:
+        with self._lock:
+            if self.centroids is not None:
+                self._remove_locked(row)
+
+    def move(self, src: int, dst: int) -> None:
+        with self._lock:
+            if self.centroids is None or self.loc_list[src] < 0:
+                return
+            idx, pos = self.loc_list[src], self.loc_pos[src]
+            self.lists[idx].ids[pos] = dst
+            self.loc_list[dst], self.loc_pos[dst] = idx, pos
+            self.loc_list[src] = -1
+
+    def search(
+        self, queries: np.ndarray, threshold: float
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        with self._lock:
+            centroids, lists = self.centroids, self.lists
+        if centroids is None:
+            return super().search(queries, threshold)
+
+        nprobe = min(self.nprobe, len(centroids))
+        # 每个特征只与最相近的 nprobe 个桶中的特征比较
+        probes = np.argpartition(-(queries @ centroids.T), nprobe - 1, axis=1)
+        probes = probes[:, :nprobe]
+        max_sims = np.zeros(len(queries), np.float32)
+        above_counts = np.zeros(len(queries), int)
+        best_rows = np.full(len(queries), -1, np.int64)
+        for idx, query in enumerate(queries):
+            for list_idx in probes[idx]:
+                lst = lists[list_idx]
+                # 读取计数后再切片，与并发的追加互不影响
+                count = lst.count
+                if not count:
+                    continue
+                sims = dot(query[None, :], lst.vecs[:count], lst.scales[:count])[0]
+                best = int(sims.argmax())
+                if best_rows[idx] < 0 or sims[best] > max_sims[idx]:
+                    max_sims[idx] = sims[best]
+                    best_rows[idx] = lst.ids[best]
+                above_counts[idx] += np.count_nonzero(sims > threshold)
+        return max_sims, above_counts, best_rows
+
+    def stats(self) -> dict:
+        return {
+            **super().stats(),
+            "trained": self.centroids is not None,
+            "nlist": 0 if self.centroids is None else len(self.centroids),
+            "nprobe": self.nprobe,
+            "trained_size": self.trained_size,
+        }
+
+
+def create_index(data, index_type: str = "flat", **kwargs) -> FlatIndex:
+    """
+    :param index_type: flat 精确检索, ivf 倒排索引, 特征库数量不足 min_train_size 时 ivf 也使用精确检索
+    """
+    if index_type == "flat":
+        return FlatIndex(data)
+    if index_type == "ivf":
+        return IVFIndex(data, **kwargs)
+    raise ValueError(f"未知的索引类型: {index_type}")
@@ -1,12 +1,14 @@
 import platform
 import time
-from typing import List
+from typing import List, Optional, Tuple
 
 import cv2
 from loguru import logger
 import numpy as np
 
+from .batcher import detect_by_shape
 from .featuredb import FeatureDB
+from .tracker import Tracker
 from .utils import get_import_meta
 
 
@@ -50,36 +52,117 @@ class Inference:
 
         self.featuredb = featuredb
 
-    def predict(self, image: np.ndarray, is_record: bool = False):
-        defects = []
-        dets, det_scores, det_labels = self.model.predict(image)
-        for det, conf, cls in zip(dets[0], det_scores[0], det_labels[0]):
-            try:
-                xmin, ymin, xmax, ymax = det
-                person_img = image[ymin : ymax + 1, xmin : xmax + 1]
-                # 正常模式下，如果背景特征库为空时，不调用特征匹配
-                if self.featuredb.db_instance.size == 0 and not is_record:
-                    is_person = True
-                else:
-                    is_person = self.featuredb.predict(person_img, is_record)
+    def detect(self, images: List[np.ndarray]) -> List[Tuple]:
+        """
+        批量检测
 
-                # 过滤掉特征匹配到的错误人物数据
-                if not is_person:
-                    continue
+        :param images: 画面列表, 尺寸可以不同
+        :return: 每张画面的 (boxes, scores, labels)
+        """
+        return detect_by_shape(self.model.predict, images)
 
-                defect = {
-                    "label": (self.model.class_names[int(cls)]),
-                    "class_id": int(cls),
-                    "prob": round(float(conf), 4),
-                    "box": {
-                        "x1": xmin,
-                        "y1": ymin,
-                        "x2": xmax,
-                        "y2": ymax,
-                    },
-                }
-                defects.append(defect)
+    def predict_crops(
+        self, crops: List[np.ndarray], is_record: bool = False
+    ) -> List[Optional[bool]]:
+        """
+        所有人物截图一次完成特征提取及比较, 失败时逐张重试
+
+        :return: 每张截图是否为真实人物, 提取失败的截图为 None
+        """
+        try:
+            return self.featuredb.predict_batch(crops, is_record)
+        except Exception as e:
+            logger.exception(f"person batch predict error, fallback per crop: {e}")
+        results = []
+        for crop in crops:
+            try:
+                results.append(self.featuredb.predict(crop, is_record))
             except Exception as e:
                 logger.exception(f"person predict error: {e}")
+                results.append(None)
+        return results
+
+    def predict(
+        self,
+        image: np.ndarray,
+        is_record: bool = False,
+        detections: Optional[Tuple] = None,
+        tracker: Optional[Tracker] = None,
+    ):
+        """
+        :param detections: 已完成的检测结果(例如批处理的结果), 为空时对画面单独检测
+        :param tracker: 画面所属摄像头的跟踪器, 不为空时结果带有跟踪ID,
+            并复用跟踪缓存的特征库比较结果
+        """
+        defects = []
+        if detections is None:
+            detections = self.detect([image])[0]
+        dets, det_scores, det_labels = detections
+
+        candidates = []
+        for det, conf, cls in zip(dets, det_scores, det_labels):
+            xmin, ymin, xmax, ymax = det
+            person_img = image[ymin : ymax + 1, xmin : xmax + 1]
+            if person_img.size == 0:
+                logger.warning(f"person box {det} is empty, skip")
+                continue
+            candidates.append((det, conf, cls, person_img))
+
+        tracks = (
+            tracker.update([candidate[0] for candidate in candidates])
+            if tracker is not None
+            else [None] * len(candidates)
+        )
+
+        # 正常模式下，如果背景特征库为空时，不调用特征匹配
+        if self.featuredb.db_instance.size == 0 and not is_record:
+            is_persons = [True] * len(candidates)
+        else:
+            # 记录模式需要保存每一帧的特征，不使用缓存结果
+            if tracker is None or is_record:
+                checks = list(range(len(candidates)))
+            else:
+                checks = [
+                    idx
+                    for idx, (candidate, track) in enumerate(zip(candidates, tracks))
+                    if tracker.need_check(track, candidate[0])
+                ]
+            is_persons = [
+                track.verdict if track is not None else True for track in tracks
+            ]
+            # 需要比较的人物截图一次完成特征提取及比较
+            if checks:
+                results = self.predict_crops(
+                    [candidates[idx][3] for idx in checks], is_record
+                )
+                for idx, is_person in zip(checks, results):
+                    # 特征提取失败的人物不输出, 也不缓存结果
+                    is_persons[idx] = bool(is_person)
+                    if is_person is None:
+                        continue
+                    if tracks[idx] is not None:
+                        tracker.set_verdict(tracks[idx], candidates[idx][0], is_person)
+
+        for (det, conf, cls, _), is_person, track in zip(
+            candidates, is_persons, tracks
+        ):
+            # 过滤掉特征匹配到的错误人物数据
+            if not is_person:
+                continue
+            xmin, ymin, xmax, ymax = det
+            defect = {
+                "label": (self.model.class_names[int(cls)]),
+                "class_id": int(cls),
+                "prob": round(float(conf), 4),
+                "box": {
+                    "x1": xmin,
+                    "y1": ymin,
+                    "x2": xmax,
+                    "y2": ymax,
+                },
+            }
+            if track is not None:
+                defect["track_id"] = track.track_id
+            defects.append(defect)
 
         return defects
@@ -0,0 +1,355 @@
+"""
+特征库文件存储
+
+files: 每个样本一个 jpg 图片及一个 npy 特征文件
+mmap: 所有特征保存在一个 npy 矩阵文件中，以 mmap 方式读写，另有一个只追加的清单文件
+      记录每个样本的 key、所在行、时间戳及图片文件；删除只追加删除记录(墓碑)，
+      墓碑较多时整理文件。图片仍按 key 单独保存，供 web 页面展示
+"""
+
+import json
+import os
+import time
+from typing import Dict, List, Optional
+
+import cv2
+import numpy as np
+from loguru import logger
+
+
+def atomic_write(path: str, data: bytes) -> None:
+    """先写临时文件再重命名，断电或进程退出时不会留下不完整的文件"""
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def save_npy(path: str, array: np.ndarray) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp, path)
+
+
+def encode_image(image: np.ndarray) -> bytes:
+    return cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 100])[1].tobytes()
+
+
+def filter_files(dir: str, suffix: str) -> List[str]:
+    return [os.path.join(dir, f) for f in os.listdir(dir) if f.endswith(suffix)]
+
+
+def remove_tmp_files(db_path: str) -> None:
+    # 清理写盘中断留下的临时文件
+    for tmp_file in filter_files(db_path, ".tmp"):
+        try:
+            os.remove(tmp_file)
+        except Exception as e:
+            logger.warning(f"remove {tmp_file} error: {e}")
+
+
+class FileStorage:
+    """每个样本一个图片文件及一个特征文件"""
+
+    name = "files"
+
+    def __init__(self, db_path: str) -> None:
+        self.db_path = db_path
+
+    def image_file(self, key: str) -> str:
+        return os.path.join(self.db_path, key + ".jpg")
+
+    def feature_file(self, key: str) -> str:
+        return os.path.join(self.db_path, key + ".npy")
+
+    def load(self) -> Dict[str, np.ndarray]:
+        remove_tmp_files(self.db_path)
+        data = {}
+        image_files = filter_files(self.db_path, ".jpg")
+        # for循环每个image，替换jpg为npy，判断是否存在该文件
+        for image_file in image_files:
+            key = os.path.splitext(os.path.basename(image_file))[0]
+            feature_file = image_file.replace(".jpg", ".npy")
+            if os.path.exists(feature_file):
+                try:
+                    data[key] = np.load(feature_file)
+                except Exception as e:
+                    logger.warning(f"load feature {key} error: {e}")
+
+        logger.info(
+            f"load {len(image_files)} images from {self.db_path}, init data size: {len(data)}"
+        )
+        return data
+
+    def save(self, key: str, image: np.ndarray, feature: np.ndarray) -> None:
+        # 加载时以图片为准，特征先于图片写入
+        save_npy(self.feature_file(key), feature)
+        atomic_write(self.image_file(key), encode_image(image))
+
+    def update(self, key: str, feature: np.ndarray) -> None:
+        """只更新特征, 图片不变"""
+        if not os.path.exists(self.image_file(key)):
+            raise FileNotFoundError(self.image_file(key))
+        save_npy(self.feature_file(key), feature)
+
+    def delete(self, key: str) -> None:
+        os.remove(self.image_file(key))
+        os.remove(self.feature_file(key))
+
+    def timestamp(self, key: str) -> Optional[float]:
+        """样本的记录时间, key 为记录时的微秒时间戳"""
+        try:
+            return int(key) / 1000000
+        except ValueError:
+            return None
+
+    def sync(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {"type": self.name}
+
+
+class MmapStorage(FileStorage):
+    """
+    单文件特征矩阵
+
+    清单文件每行一条 json 记录:
+    {"op": "features", "file": 特征矩阵文件名, "dim": 维度}  特征矩阵文件扩容或整理后切换
+    {"op": "add", "key": key, "row": 行号, "ts": 时间戳, "image": 图片文件名}
+    {"op": "del", "key": key}
+    新的特征矩阵文件写完后才追加或重写清单，清单是唯一的提交点，
+    写入中断时最后一行不完整的记录在加载时忽略
+    """
+
+    name = "mmap"
+    manifest_name = "manifest.jsonl"
+
+    def __init__(self, db_path: str, compact_ratio: float = 0.5) -> None:
+        super().__init__(db_path)
+        # 墓碑占已使用行数的比例超过该值时整理
+        self.compact_ratio = compact_ratio
+        self.manifest_path = os.path.join(db_path, self.manifest_name)
+        self.features_name: Optional[str] = None
+        self.generation = 0
+        self._matrix: Optional[np.memmap] = None
+        self._manifest = None
+        # key -> (行号, 时间戳)
+        self.entries: Dict[str, tuple] = {}
+        # 已使用的行数, 包括墓碑
+        self.used = 0
+
+    @property
+    def tombstones(self) -> int:
+        return self.used - len(self.entries)
+
+    def _features_path(self, name: str) -> str:
+        return os.path.join(self.db_path, name)
+
+    def _replay(self) -> None:
+        self.entries, self.used = {}, 0
+        self.features_name = None
+        if not os.path.exists(self.manifest_path):
+            return
+        with open(self.manifest_path, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warning(f"skip broken manifest record: {line!r}")
+                    continue
+                op = record.get("op")
+                if op == "features":
+                    self.features_name = record["file"]
+                    self.generation = max(
+                        self.generation, int(record.get("generation", 0))
+                    )
+                elif op == "add":
+                    self.entries[record["key"]] = (record["row"], record["ts"])
+                    self.used = max(self.used, record["row"] + 1)
+                elif op == "del":
+                    self.entries.pop(record["key"], None)
+
+    def load(self) -> Dict[str, np.ndarray]:
+        remove_tmp_files(self.db_path)
+        self._replay()
+        data = {}
+        if self.features_name:
+            path = self._features_path(self.features_name)
+            try:
+                # 只读映射文件，访问到的行才会被读取, 第一次写入时再以读写方式映射
+                self._matrix = np.load(path, mmap_mode="r")
+            except Exception as e:
+                logger.warning(f"load features {path} error: {e}")
+                self._matrix = None
+                self.entries, self.used = {}, 0
+        if self._matrix is not None:
+            capacity = len(self._matrix)
+            for key, (row, _) in list(self.entries.items()):
+                if row >= capacity:
+                    # 特征写入文件前就中断的记录
+                    self.entries.pop(key)
+                    continue
+                data[key] = self._matrix[row]
+        self._remove_stale_features()
+        logger.info(
+            f"load {len(data)} features from {self.manifest_path}, tombstones: {self.tombstones}"
+        )
+        return data
+
+    def _remove_stale_features(self) -> None:
+        # 扩容或整理中断后遗留的旧特征矩阵文件
+        for path in filter_files(self.db_path, ".features.npy"):
+            if os.path.basename(path) != self.features_name:
+                try:
+                    os.remove(path)
+                except Exception as e:
+                    logger.warning(f"remove {path} error: {e}")
+
+    def _append_records(self, *records: dict) -> None:
+        if self._manifest is None:
+            self._manifest = open(self.manifest_path, "a")
+        for record in records:
+            self._manifest.write(json.dumps(record) + "\n")
+        self._manifest.flush()
+
+    def _new_features(self, rows: np.ndarray, capacity: int) -> str:
+        """写入新的特征矩阵文件，返回文件名"""
+        self.generation += 1
+        name = f"{self.generation}.features.npy"
+        path = self._features_path(name)
+        matrix = np.lib.format.open_memmap(
+            path + ".tmp", mode="w+", dtype=np.float32, shape=(capacity, rows.shape[1])
+        )
+        matrix[: len(rows)] = rows
+        matrix.flush()
+        del matrix
+        os.replace(path + ".tmp", path)
+        return name
+
+    def _switch(self, name: str) -> None:
+        old = self.features_name
+        self._matrix = np.load(self._features_path(name), mmap_mode="r+")
+        self.features_name = name
+        if old and old != name:
+            try:
+                os.remove(self._features_path(old))
+            except Exception as e:
+                logger.warning(f"remove {old} error: {e}")
+
+    def _grow(self, dim: int) -> None:
+        if self._matrix is None:
+            rows = np.empty((0, dim), np.float32)
+            capacity = 1024
+        else:
+            if self._matrix.shape[1] != dim:
+                raise ValueError(f"feature dim {dim} not match {self._matrix.shape[1]}")
+            rows = self._matrix[: self.used]
+            capacity = len(self._matrix) * 2
+        name = self._new_features(rows, capacity)
+        self._append_records(
+            {"op": "features", "file": name, "dim": dim, "generation": self.generation}
+        )
+        self._switch(name)
+
+    def save(self, key: str, image: np.ndarray, feature: np.ndarray) -> None:
+        atomic_write(self.image_file(key), encode_image(image))
+        self.append(key, feature)
+
+    def append(self, key: str, feature: np.ndarray, ts: Optional[float] = None):
+        """追加特征, 图片文件 key.jpg 需已存在"""
+        feature = np.asarray(feature, dtype=np.float32).reshape(-1)
+        if self._matrix is None or self.used == len(self._matrix):
+            self._grow(len(feature))
+        elif self._matrix.mode == "r":
+            self._matrix = np.load(
+                self._features_path(self.features_name), mmap_mode="r+"
+            )
+        row = self.used
+        self._matrix[row] = feature
+        self.used += 1
+        ts = time.time() if ts is None else ts
+        self.entries[key] = (row, ts)
+        self._append_records(
+            {"op": "add", "key": key, "row": row, "ts": ts, "image": key + ".jpg"}
+        )
+
+    def update(self, key: str, feature: np.ndarray) -> None:
+        entry = self.entries.get(key)
+        if entry is None:
+            raise KeyError(key)
+        # 追加新行, 原来的行成为墓碑
+        self.append(key, feature, entry[1])
+
+    def timestamp(self, key: str) -> Optional[float]:
+        entry = self.entries.get(key)
+        return entry[1] if entry else super().timestamp(key)
+
+    def delete(self, key: str) -> None:
+        if self.entries.pop(key, None) is None:
+            raise KeyError(key)
+        self._append_records({"op": "del", "key": key})
+        os.remove(self.image_file(key))
+        if self.tombstones > max(self.used * self.compact_ratio, 64):
+            self.compact()
+
+    def compact(self) -> None:
+        """只保留有效的行，重写特征矩阵及清单"""
+        if self._matrix is None:
+            return
+        keys = list(self.entries)
+        rows = np.array([self.entries[key][0] for key in keys], dtype=np.int64)
+        live = np.asarray(self._matrix[rows]) if len(rows) else None
+        dim = self._matrix.shape[1]
+        if live is None:
+            live = np.empty((0, dim), np.float32)
+        name = self._new_features(live, max(len(live) * 2, 1024))
+        records = [
+            {"op": "features", "file": name, "dim": dim, "generation": self.generation}
+        ]
+        entries = {}
+        for row, key in enumerate(keys):
+            ts = self.entries[key][1]
+            entries[key] = (row, ts)
+            records.append(
+                {"op": "add", "key": key, "row": row, "ts": ts, "image": key + ".jpg"}
+            )
+        if self._manifest is not None:
+            self._manifest.close()
+            self._manifest = None
+        atomic_write(
+            self.manifest_path,
+            "".join(json.dumps(record) + "\n" for record in records).encode(),
+        )
+        self.entries, self.used = entries, len(keys)
+        self._switch(name)
+        logger.info(f"compact features to {name}, size: {len(keys)}")
+
+    def sync(self) -> None:
+        if self._matrix is not None:
+            self._matrix.flush()
+        if self._manifest is not None:
+            self._manifest.flush()
+            os.fsync(self._manifest.fileno())
+
+    def stats(self) -> dict:
+        return {
+            "type": self.name,
+            "file": self.features_name,
+            "size": len(self.entries),
+            "used": self.used,
+            "capacity": 0 if self._matrix is None else len(self._matrix),
+            "tombstones": self.tombstones,
+        }
+
+
+def create_storage(db_path: str, storage_type: str = "files") -> FileStorage:
+    """
+    :param storage_type: files 每个样本单独保存特征文件, mmap 所有特征保存在一个矩阵文件中
+    """
+    if storage_type == "files":
+        return FileStorage(db_path)
+    if storage_type == "mmap":
+        return MmapStorage(db_path)
+    raise ValueError(f"未知的特征库存储方式: {storage_type}")
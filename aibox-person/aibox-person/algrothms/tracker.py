@@ -0,0 +1,204 @@
+"""
+多目标跟踪，SORT 方式: 卡尔曼滤波预测人物框位置，再按 IoU 与当前帧检测框匹配
+
+同一摄像头中持续出现的人物保持相同的跟踪ID，并缓存该人物的特征库比较结果，
+只在间隔一定帧数或人物框明显变化后重新提取特征比较
+"""
+
+import threading
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+
+def iou_matrix(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    """
+    :param boxes_a: (n, 4) x1, y1, x2, y2
+    :param boxes_b: (m, 4) x1, y1, x2, y2
+    :return: (n, m) IoU
+    """
+    if not len(boxes_a) or not len(boxes_b):
+        return np.zeros((len(boxes_a), len(boxes_b)), dtype=np.float32)
+    a = boxes_a[:, None, :]
+    b = boxes_b[None, :, :]
+    w = np.clip(
+        np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None
+    )
+    h = np.clip(
+        np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None
+    )
+    inter = w * h
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    union = area_a + area_b - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-6), 0).astype(np.float32)
+
+
+class KalmanBox:
+    """
+    匀速运动模型的卡尔曼滤波
+
+    状态: 中心点 cx, cy, 面积 s, 宽高比 r 及 cx, cy, s 的速度, 宽高比视为不变
+    """
+
+    # 状态转移矩阵
+    F = np.eye(7)
+    F[0, 4] = F[1, 5] = F[2, 6] = 1
+    # 观测矩阵
+    H = np.eye(4, 7)
+    # 观测噪声
+    R = np.diag([1.0, 1.0, 10.0, 10.0])
+    # 过程噪声
+    Q = np.diag([1.0, 1.0, 1.0, 1.0, 0.01, 0.01, 0.0001])
+
+    def __init__(self, box: np.ndarray) -> None:
+        self.x = np.zeros(7)
+        self.x[:4] = self.to_z(box)
+        # 初始速度未知，给较大的不确定度
+        self.P = np.diag([10.0, 10.0, 10.0, 10.0, 10000.0, 10000.0, 10000.0])
+
+    @staticmethod
+    def to_z(box: np.ndarray) -> np.ndarray:
+        w, h = box[2] - box[0], box[3] - box[1]
+        return np.array(
+            [box[0] + w / 2, box[1] + h / 2, w * h, w / max(h, 1e-6)], dtype=np.float64
+        )
+
+    def to_box(self) -> np.ndarray:
+        cx, cy, s, r = self.x[:4]
+        w = np.sqrt(max(s * r, 0))
+        h = s / w if w > 0 else 0
+        return np.array([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2])
+
+    def predict(self) -> np.ndarray:
+        # 面积不能小于0
+        if self.x[2] + self.x[6] <= 0:
+            self.x[6] = 0
+        self.x = self.F @ self.x
+        self.P = self.F @ self.P @ self.F.T + self.Q
+        return self.to_box()
+
+    def update(self, box: np.ndarray) -> None:
+        y = self.to_z(box) - self.H @ self.x
+        S = self.H @ self.P @ self.H.T + self.R
+        K = self.P @ self.H.T @ np.linalg.inv(S)
+        self.x = self.x + K @ y
+        self.P = (np.eye(7) - K @ self.H) @ self.P
+
+
+class Track:
+    def __init__(self, track_id: int, box: np.ndarray) -> None:
+        self.track_id = track_id
+        self.kalman = KalmanBox(box)
+        # 连续未匹配到检测框的帧数
+        self.misses = 0
+        self.hits = 1
+        # 缓存的特征库比较结果, None 表示尚未比较
+        self.verdict: Optional[bool] = None
+        # 比较时的人物框及之后经过的帧数
+        self.verdict_box: Optional[np.ndarray] = None
+        self.verdict_age = 0
+
+
+class Tracker:
+    """
+    单个摄像头的跟踪器
+
+    每帧调用 update 为所有检测框分配跟踪ID，未匹配的检测框创建新的跟踪，
+    连续 max_age 帧未匹配的跟踪被删除
+    """
+
+    def __init__(
+        self,
+        iou_threshold: float = 0.3,
+        max_age: int = 30,
+        recheck_interval: int = 25,
+        recheck_iou: float = 0.7,
+    ) -> None:
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.recheck_interval = recheck_interval
+        self.recheck_iou = recheck_iou
+        self.tracks: List[Track] = []
+        self._next_id = 1
+        # 多个 worker 可能同时处理同一摄像头的画面
+        self._lock = threading.Lock()
+        # 复用缓存结果及重新比较的人物数量
+        self.cached = 0
+        self.checked = 0
+
+    def update(self, boxes: Sequence[Sequence[float]]) -> List[Track]:
+        """
+        :param boxes: 当前帧的检测框 x1, y1, x2, y2
+        :return: 与 boxes 一一对应的跟踪
+        """
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        with self._lock:
+            predicted = np.array(
+                [track.kalman.predict() for track in self.tracks], dtype=np.float64
+            ).reshape(-1, 4)
+            for track in self.tracks:
+                track.verdict_age += 1
+            assigned: List[Optional[Track]] = [None] * len(boxes)
+            matched_tracks = set()
+            ious = iou_matrix(predicted, boxes)
+            # 贪心匹配: 按 IoU 从大到小依次匹配尚未使用的跟踪及检测框
+            if ious.size:
+                order = np.argsort(-ious, axis=None)
+                for flat in order:
+                    t_idx, d_idx = divmod(int(flat), len(boxes))
+                    if ious[t_idx, d_idx] < self.iou_threshold:
+                        break
+                    if t_idx in matched_tracks or assigned[d_idx] is not None:
+                        continue
+                    track = self.tracks[t_idx]
+                    track.kalman.update(boxes[d_idx])
+                    track.misses = 0
+                    track.hits += 1
+                    assigned[d_idx] = track
+                    matched_tracks.add(t_idx)
+
+            for t_idx, track in enumerate(self.tracks):
+                if t_idx not in matched_tracks:
+                    track.misses += 1
+            self.tracks = [
+                track for track in self.tracks if track.misses <= self.max_age
+            ]
+
+            for d_idx, track in enumerate(assigned):
+                if track is None:
+                    track = Track(self._next_id, boxes[d_idx])
+                    self._next_id += 1
+                    self.tracks.append(track)
+                    assigned[d_idx] = track
+            return assigned
+
+    def need_check(self, track: Track, box: Sequence[float]) -> bool:
+        """缓存结果不存在、已超过 recheck_interval 帧或人物框与比较时相比变化较大时需要重新比较"""
+        need = track.verdict is None or track.verdict_age >= self.recheck_interval
+        if not need:
+            box = np.asarray(box, dtype=np.float64).reshape(1, 4)
+            need = bool(
+                iou_matrix(track.verdict_box[None, :], box)[0, 0] < self.recheck_iou
+            )
+        with self._lock:
+            if need:
+                self.checked += 1
+            else:
+                self.cached += 1
+        return need
+
+    def set_verdict(self, track: Track, box: Sequence[float], verdict: bool) -> None:
+        track.verdict = verdict
+        track.verdict_box = np.asarray(box, dtype=np.float64)
+        track.verdict_age = 0
+
+    def stats(self) -> dict:
+        total = self.cached + self.checked
+        return {
+            "tracks": len(self.tracks),
+            "next_id": self._next_id,
+            "cached": self.cached,
+            "checked": self.checked,
+            "cache_ratio": round(self.cached / total, 4) if total else 0,
+        }
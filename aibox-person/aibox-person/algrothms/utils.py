@@ -1,8 +1,11 @@
-from typing import List
+from typing import TYPE_CHECKING, List
 
 import cv2
 import numpy as np
-from coral import ObjectPayload
+
+if TYPE_CHECKING:
+    # 仅用于类型注解, 特征库等模块导入 utils 时不依赖 coral 运行时
+    from coral import ObjectPayload
 
 
 def get_import_meta(model_type: str):
@@ -17,11 +20,11 @@ def get_import_meta(model_type: str):
     return meta
 
 
-def draw_image_with_boxes(image: np.ndarray, objects: List[ObjectPayload]):
+def draw_image_with_boxes(image: np.ndarray, objects: List["ObjectPayload"]):
     # 基于objects的box和label在图像上画对应的框和label标记
     def _draw(
         image: np.ndarray,
-        object: ObjectPayload,
+        object: "ObjectPayload",
         box_color=(0, 255, 0),
         label_color=(0, 0, 255),
     ):
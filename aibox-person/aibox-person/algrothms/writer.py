@@ -0,0 +1,181 @@
+"""
+特征库后台写盘，记录模式下图片编码及写文件不占用识别线程
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Deque, Optional, Set, Tuple
+
+import numpy as np
+from loguru import logger
+
+from .storage import FileStorage
+
+
+class FeatureWriter:
+    """
+    特征库写盘队列
+
+    save/update/delete 按提交顺序由后台线程执行，每次唤醒处理队列中的一批任务，
+    一批任务完成后再统一刷盘。
+    队列中的保存任务达到 max_queue 时丢弃新的保存任务: 样本仍在内存中的特征库中，
+    但不会再写盘，重启后永久丢失。被丢弃样本之后的更新及删除任务直接跳过并计入 skipped，
+    其余更新及删除任务不会被丢弃。max_queue 为 0 时在调用线程中同步写盘
+    """
+
+    def __init__(
+        self, storage: FileStorage, max_queue: int = 256, batch_size: int = 32
+    ) -> None:
+        self.storage = storage
+        self.max_queue = max(max_queue, 0)
+        self.batch_size = max(batch_size, 1)
+        self._cond = threading.Condition()
+        # (操作, key, 图像, 特征)
+        self._queue: Deque[
+            Tuple[str, str, Optional[np.ndarray], Optional[np.ndarray]]
+        ] = deque()
+        self._saves = 0
+        # 保存任务被丢弃的 key, 其后续的更新及删除任务无文件可操作
+        self._dropped_keys: Set[str] = set()
+        self._busy = False
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+        # 统计
+        self.written = 0
+        self.deleted = 0
+        self.dropped = 0
+        self.failed = 0
+        self.skipped = 0
+        self.max_depth = 0
+        self.write_ms = 0.0
+
+    def _start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._run, name="featuredb-writer", daemon=True
+        )
+        self._thread.start()
+
+    def _put(self, task) -> None:
+        if self._thread is None:
+            self._start()
+        self._queue.append(task)
+        self.max_depth = max(self.max_depth, len(self._queue))
+        self._cond.notify()
+
+    def save(self, key: str, image: np.ndarray, feature: np.ndarray) -> bool:
+        """
+        :return: 是否加入队列, 队列已满或已关闭时返回 False
+        """
+        if not self.max_queue:
+            self._execute("save", key, image, feature)
+            self._sync()
+            return True
+        with self._cond:
+            if self._closed or self._saves >= self.max_queue:
+                self.dropped += 1
+                self._dropped_keys.add(key)
+                logger.warning(f"featuredb writer queue full, drop {key}")
+                return False
+            self._saves += 1
+            self._dropped_keys.discard(key)
+            self._put(("save", key, image, feature))
+        return True
+
+    def update(self, key: str, feature: np.ndarray) -> None:
+        """更新已保存样本的特征, 与删除任务一样不会被丢弃"""
+        self._submit("update", key, feature)
+
+    def delete(self, key: str) -> None:
+        self._submit("delete", key)
+
+    def _submit(self, op: str, key: str, feature: Optional[np.ndarray] = None):
+        if not self.max_queue:
+            self._execute(op, key, None, feature)
+            self._sync()
+            return
+        with self._cond:
+            if self._closed:
+                return
+            if key in self._dropped_keys:
+                self.skipped += 1
+                if op == "delete":
+                    self._dropped_keys.discard(key)
+                return
+            self._put((op, key, None, feature))
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                batch = [
+                    self._queue.popleft()
+                    for _ in range(min(self.batch_size, len(self._queue)))
+                ]
+                self._busy = True
+            st = time.time()
+            for task in batch:
+                self._execute(*task)
+            self._sync()
+            with self._cond:
+                self._saves -= sum(1 for task in batch if task[0] == "save")
+                self.write_ms += (time.time() - st) * 1000
+                self._busy = False
+                self._cond.notify_all()
+
+    def _execute(self, op: str, key: str, image, feature) -> None:
+        try:
+            if op == "save":
+                self.storage.save(key, image, feature)
+                self.written += 1
+            elif op == "update":
+                self.storage.update(key, feature)
+                self.written += 1
+            else:
+                self.storage.delete(key)
+                self.deleted += 1
+        except Exception as e:
+            self.failed += 1
+            logger.warning(f"{op} feature {key} error: {e}")
+
+    def _sync(self) -> None:
+        try:
+            self.storage.sync()
+        except Exception as e:
+            logger.warning(f"sync featuredb storage error: {e}")
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待已提交的任务全部完成"""
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: not self._queue and not self._busy, timeout
+            )
+
+    def close(self, timeout: float = 5) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "storage": self.storage.stats(),
+                "queue_depth": len(self._queue),
+                "max_queue": self.max_queue,
+                "max_depth": self.max_depth,
+                "written": self.written,
+                "deleted": self.deleted,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "skipped": self.skipped,
+                "avg_write_ms": (
+                    round(self.write_ms / (self.written + self.deleted), 3)
+                    if self.written + self.deleted
+                    else 0
+                ),
+            }
@@ -0,0 +1,97 @@
+"""
+特征库索引基准测试, 使用模拟特征比较 ivf 与精确检索的召回率及耗时
+
+python benchmark_index.py --size 20000 --dim 512 --nprobe 4 8 16
+"""
+
+import argparse
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from algrothms.featuredb import FeatureData
+
+
+def gen_features(size: int, dim: int, clusters: int, rng: np.random.Generator):
+    # 模拟误检样本: 同一位置的背景截图特征聚集在少数中心附近
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, size)
+    features = centers[labels] + 0.6 * rng.standard_normal((size, dim)).astype(
+        np.float32
+    )
+    return features
+
+
+def gen_queries(features: np.ndarray, count: int, rng: np.random.Generator):
+    # 一半为特征库中样本加噪声(应当匹配), 一半为随机特征(不应匹配)
+    half = count // 2
+    near = features[rng.integers(0, len(features), half)]
+    near = near + 0.2 * rng.standard_normal(near.shape).astype(np.float32)
+    far = rng.standard_normal((count - half, features.shape[1])).astype(np.float32)
+    queries = np.vstack([near, far])
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def bench(db: FeatureData, queries: np.ndarray, threshold: float, batch: int):
+    st = time.time()
+    max_sims, above_counts = [], []
+    for start in range(0, len(queries), batch):
+        m, c = db.search(queries[start : start + batch], threshold)
+        max_sims.append(m)
+        above_counts.append(c)
+    cost = (time.time() - st) * 1000 / len(queries)
+    return np.concatenate(max_sims), np.concatenate(above_counts), cost
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--clusters", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--batch", type=int, default=20, help="每帧人物数量")
+    parser.add_argument("--threshold", type=float, default=0.9)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    features = gen_features(args.size, args.dim, args.clusters, rng)
+    queries = gen_queries(features, args.queries, rng)
+    data = {str(idx): feature for idx, feature in enumerate(features)}
+
+    db_path = tempfile.mkdtemp()
+    try:
+        flat = FeatureData(data, db_path, args.size)
+        exact_sims, exact_counts, flat_cost = bench(
+            flat, queries, args.threshold, args.batch
+        )
+        exact_matched = exact_counts > 0
+        print(
+            f"flat: {flat_cost:.3f} ms/query, matched {exact_matched.sum()}/{len(queries)}"
+        )
+
+        st = time.time()
+        ivf = FeatureData(
+            data, db_path, args.size, "ivf", {"min_train_size": 0, "nprobe": 1}
+        )
+        print(f"ivf train: {time.time() - st:.2f} s, {ivf.index.stats()}")
+        for nprobe in args.nprobe:
+            ivf.index.nprobe = nprobe
+            sims, counts, cost = bench(ivf, queries, args.threshold, args.batch)
+            matched = counts > 0
+            # 召回率: 精确检索匹配的特征中 ivf 同样匹配的比例
+            recall = (matched & exact_matched).sum() / max(exact_matched.sum(), 1)
+            # 精确检索匹配的特征中 ivf 找到的最相似特征与精确结果一致的比例
+            top1 = np.isclose(sims, exact_sims, atol=1e-5)[exact_matched].mean()
+            print(
+                f"ivf nprobe={nprobe}: {cost:.3f} ms/query, speedup {flat_cost / cost:.1f}x, "
+                f"match recall {recall:.4f}, top1 recall {top1:.4f}"
+            )
+    finally:
+        shutil.rmtree(db_path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+特征存储精度对比, 使用模拟特征比较 float16/int8 与 float32 的相似度误差、匹配结果一致性、内存及耗时
+
+python benchmark_precision.py --size 20000 --dim 512
+"""
+
+import argparse
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from algrothms.featuredb import FeatureData
+from benchmark_index import bench, gen_features, gen_queries
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--clusters", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--batch", type=int, default=20, help="每帧人物数量")
+    parser.add_argument("--threshold", type=float, default=0.9)
+    parser.add_argument(
+        "--precision", nargs="+", default=["float32", "float16", "int8"]
+    )
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    features = gen_features(args.size, args.dim, args.clusters, rng)
+    queries = gen_queries(features, args.queries, rng)
+    data = {str(idx): feature for idx, feature in enumerate(features)}
+
+    db_path = tempfile.mkdtemp()
+    try:
+        exact = FeatureData(data, db_path, args.size)
+        exact_sims, exact_counts, exact_cost = bench(
+            exact, queries, args.threshold, args.batch
+        )
+        exact_rows = (queries @ exact.matrix.T).argmax(axis=1)
+        for precision in args.precision:
+            st = time.time()
+            db = FeatureData(data, db_path, args.size, precision=precision)
+            load_cost = time.time() - st
+            sims, counts, cost = bench(db, queries, args.threshold, args.batch)
+            rows = db.dot(queries).argmax(axis=1)
+            stats = db.stats()
+            print(
+                f"{precision}: {stats['matrix_bytes'] / 1024 / 1024:.1f} MB, "
+                f"load {load_cost:.2f} s, {cost:.3f} ms/query "
+                f"({exact_cost / cost:.2f}x of float32), "
+                f"max sim error {np.abs(sims - exact_sims).max():.5f}, "
+                f"match agreement {((counts > 0) == (exact_counts > 0)).mean():.4f}, "
+                f"above count error {np.abs(counts - exact_counts).mean():.3f}, "
+                f"top1 agreement {(rows == exact_rows).mean():.4f}"
+            )
+    finally:
+        shutil.rmtree(db_path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
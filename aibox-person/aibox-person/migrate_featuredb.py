@@ -0,0 +1,72 @@
+"""
+特征库存储方式迁移, 迁移前需停止节点
+
+python migrate_featuredb.py --db-path /path/to/db/person --to mmap
+python migrate_featuredb.py --db-path /path/to/db/person --to files
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+from algrothms.storage import FileStorage, MmapStorage, filter_files, save_npy
+
+
+def to_mmap(db_path: str, remove_old: bool) -> None:
+    source = FileStorage(db_path)
+    target = MmapStorage(db_path)
+    if os.path.exists(target.manifest_path):
+        raise SystemExit(f"{target.manifest_path} 已存在, 特征库已是 mmap 存储方式")
+
+    data = source.load()
+    st = time.time()
+    # 按 key(记录时的时间戳) 顺序写入, 时间戳取特征文件的修改时间
+    for key in sorted(data):
+        ts = os.path.getmtime(source.feature_file(key))
+        target.append(key, data[key], ts)
+    target.sync()
+    print(
+        f"migrate {len(data)} features to {target.features_name} cost {time.time() - st:.2f} s"
+    )
+    if remove_old:
+        for feature_file in filter_files(db_path, ".npy"):
+            if not feature_file.endswith(".features.npy"):
+                os.remove(feature_file)
+
+
+def to_files(db_path: str, remove_old: bool) -> None:
+    source = MmapStorage(db_path)
+    if not os.path.exists(source.manifest_path):
+        raise SystemExit(f"{source.manifest_path} 不存在, 特征库已是 files 存储方式")
+
+    data = source.load()
+    st = time.time()
+    for key, feature in data.items():
+        save_npy(source.feature_file(key), np.asarray(feature).reshape(1, -1))
+    print(f"migrate {len(data)} features to npy files cost {time.time() - st:.2f} s")
+    if remove_old:
+        # 清单是 mmap 存储方式的标志, 最先删除
+        os.remove(source.manifest_path)
+        for features_file in filter_files(db_path, ".features.npy"):
+            os.remove(features_file)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db-path", required=True, help="特征库目录")
+    parser.add_argument("--to", choices=["mmap", "files"], default="mmap")
+    parser.add_argument(
+        "--keep-old", action="store_true", help="保留原存储方式的特征文件"
+    )
+    args = parser.parse_args()
+
+    if args.to == "mmap":
+        to_mmap(args.db_path, not args.keep_old)
+    else:
+        to_files(args.db_path, not args.keep_old)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,9 @@
+import sys
 import time
-from typing import Dict, List, Any
+import atexit
+import signal
+import threading
+from typing import Dict, List, Any, Optional, Tuple
 
 import cv2
 import numpy as np
@@ -17,7 +21,9 @@ from loguru import logger
 
 import web
 from algrothms.featuredb import FeatureDB, FeatureData
+from algrothms.batcher import DetectionBatcher
 from algrothms.inference import Inference
+from algrothms.tracker import Tracker
 from schema import AIboxPersonParamsModel
 
 
@@ -25,6 +31,16 @@ from schema import AIboxPersonParamsModel
 PTManager.register()(AIboxPersonParamsModel)
 
 
+def signal_exit(signal, frame):
+    logger.info("receive signal: {}".format(signal))
+    # 通过 sys.exit 退出以执行 atexit 注册的特征库写盘
+    sys.exit(0)
+
+
+# 注册信号触发
+signal.signal(signal.SIGTERM, signal_exit)
+
+
 class AIboxPerson(CoralNode):
 
     # 配置文件，默认文件config.json, 可通过环境变量 CORAL_NODE_CONFIG_PATH 覆盖
@@ -38,13 +54,52 @@ class AIboxPerson(CoralNode):
     def __init__(self):
         super().__init__()
         # 主线程加载数据
+        feat_params = self.params.featuredb
         self.db_instance = FeatureData.load(
-            self.params.featuredb.db_path, self.params.featuredb.db_size
+            feat_params.db_path,
+            feat_params.db_size,
+            index_type=feat_params.index_type,
+            index_params=(
+                {
+                    "nprobe": feat_params.ivf_nprobe,
+                    "min_train_size": feat_params.ivf_min_train_size,
+                }
+                if feat_params.index_type == "ivf"
+                else None
+            ),
+            write_queue_size=feat_params.write_queue_size,
+            storage_type=feat_params.storage_type,
+            evict_policy=feat_params.evict_policy,
+            max_age_days=feat_params.max_age_days,
+            merge_threshold=feat_params.merge_threshold,
+            precision=feat_params.precision,
         )
+        # 退出前写完写盘队列中的样本及删除任务
+        atexit.register(self.db_instance.close)
         # 更新node_id变量，并启动web服务
         web.node_id = self.config.node_id
         web.async_run(self.config.node_id, self.params.featuredb.db_path)
         self.masks = {}
+        # 各 worker 共享的检测批处理，批大小超过 worker 数量时永远凑不满
+        self.batcher = DetectionBatcher(
+            batch_size=min(self.params.detection.batch_size, self.process.count),
+            max_wait_ms=self.params.detection.batch_wait_ms,
+        )
+        web.batcher = self.batcher
+        # 各摄像头最近一次的识别结果, (原始结果, 过滤后结果)
+        self.last_results: Dict[
+            str, Tuple[List[ObjectPayload], List[ObjectPayload]]
+        ] = {}
+        # 各摄像头的人物跟踪器, 同一摄像头的画面可能由不同 worker 处理
+        self.trackers: Dict[str, Tracker] = {}
+        self._trackers_lock = threading.Lock()
+        web.trackers = self.trackers
+        # 启动时检查一次 ObjectPayload 能否携带 track_id, 不支持时跟踪只用于缓存比较结果
+        self.emit_track_id = self.track_id_supported()
+        if self.params.tracker.enable and not self.emit_track_id:
+            logger.warning(
+                "coral 的 ObjectPayload 未声明 track_id 字段且不允许扩展字段, 识别结果不输出跟踪ID"
+            )
 
     def init(self, index: int, context: dict):
         """
@@ -63,6 +118,7 @@ class AIboxPerson(CoralNode):
             device_id=feat_params.device_id,
             sim_threshold=feat_params.sim_threshold,
             db_instance=self.db_instance,
+            batch_size=feat_params.batch_size,
         )
         inference = Inference(
             featuredb=featuredb,
@@ -92,29 +148,62 @@ class AIboxPerson(CoralNode):
             model: Inference = context["model"]
             iou_thresh = payload.raw_params["iou_scale"]
             points = payload.raw_params["points"]
-            # mask不存在或者参数与创建mask时值不同时，就更新
+            shape = payload.raw.shape
+            # mask不存在或者参数、分辨率与创建mask时不同时，就更新
             if (
                 not self.masks.get(payload.source_id)
                 or self.masks[payload.source_id]["iou_thresh"] != iou_thresh
                 or self.masks[payload.source_id]["points"] != points
+                or self.masks[payload.source_id]["shape"] != shape
             ):
                 mask = self.gen_mask(payload.raw, payload.raw_params)
                 self.masks[payload.source_id] = {
                     "iou_thresh": iou_thresh,
                     "points": points,
+                    "shape": shape,
                     "mask": mask,
+                    "roi": self.gen_roi(shape, points, self.params.roi_margin),
                 }
+                # mask变化后不能复用之前的识别结果
+                self.last_results.pop(payload.source_id, None)
             else:
                 mask = self.masks[payload.source_id]["mask"]
-            defects = model.predict(payload.raw, self.params.is_record)
-            objects = [ObjectPayload(**defect) for defect in defects]
-            # 过滤与mask不重合的objects
-            if mask is not None:
-                filter_objects = self.filter_objects(
-                    mask, objects, iou_thresh, self.params.box_slice_count
-                )
+            roi = self.masks[payload.source_id]["roi"] if self.params.roi_crop else None
+
+            stats = web.motion_stats[payload.source_id]
+            stats["frames"] += 1
+            # 摄像头节点判定画面未变化时，复用上一次的识别结果
+            motion = payload.raw_params.get("motion")
+            if (
+                motion
+                and not motion["changed"]
+                and payload.source_id in self.last_results
+            ):
+                stats["skipped"] += 1
+                objects, filter_objects = self.last_results[payload.source_id]
             else:
-                filter_objects = objects
+                if roi is None:
+                    detections = self.batcher.detect(model, payload.raw)
+                else:
+                    # 只检测 mask 外接矩形区域，再将检测框映射回原图坐标
+                    x0, y0, x1, y1 = roi
+                    detections = self.batcher.detect(model, payload.raw[y0:y1, x0:x1])
+                    detections = self.offset_detections(detections, x0, y0)
+                defects = model.predict(
+                    payload.raw,
+                    self.params.is_record,
+                    detections=detections,
+                    tracker=self.get_tracker(payload.source_id),
+                )
+                objects = [self.to_object(defect) for defect in defects]
+                # 过滤与mask不重合的objects
+                if mask is not None:
+                    filter_objects = self.filter_objects(
+                        mask, objects, iou_thresh, self.params.box_slice_count
+                    )
+                else:
+                    filter_objects = objects
+                self.last_results[payload.source_id] = (objects, filter_objects)
         else:
             objects = []
             filter_objects = []
@@ -125,31 +214,115 @@ class AIboxPerson(CoralNode):
             )
         return ObjectsPayload(objects=filter_objects, mode=InterfaceMode.APPEND)
 
+    def get_tracker(self, source_id: str) -> Optional[Tracker]:
+        params = self.params.tracker
+        if not params.enable:
+            return None
+        tracker = self.trackers.get(source_id)
+        if tracker is None:
+            with self._trackers_lock:
+                tracker = self.trackers.get(source_id)
+                if tracker is None:
+                    tracker = Tracker(
+                        iou_threshold=params.iou_threshold,
+                        max_age=params.max_age,
+                        recheck_interval=params.recheck_interval,
+                        recheck_iou=params.recheck_iou,
+                    )
+                    self.trackers[source_id] = tracker
+        return tracker
+
+    def to_object(self, defect: Dict[str, Any]) -> ObjectPayload:
+        """识别结果转换为 ObjectPayload, 跟踪ID作为扩展字段 track_id 传递给下游节点"""
+        track_id = defect.pop("track_id", None)
+        obj = ObjectPayload(**defect)
+        if track_id is not None and self.emit_track_id:
+            obj.track_id = track_id
+        return obj
+
+    @classmethod
+    def track_id_supported(cls) -> bool:
+        """ObjectPayload 已声明 track_id 字段或允许扩展字段(兼容 pydantic v1/v2)"""
+        fields = getattr(ObjectPayload, "model_fields", None) or getattr(
+            ObjectPayload, "__fields__", {}
+        )
+        if "track_id" in fields:
+            return True
+        config = getattr(ObjectPayload, "model_config", None)
+        if config is not None:
+            extra = config.get("extra")
+        else:
+            extra = getattr(getattr(ObjectPayload, "__config__", None), "extra", None)
+        return getattr(extra, "value", extra) == "allow"
+
     @classmethod
     def gen_mask(cls, raw: np.ndarray, raw_params: Dict[str, Any]):
+        """
+        生成 mask 的积分图，任意矩形区域内的 mask 像素数只需查表 4 次
+
+        :return: 积分图，没有配置 mask 时返回 None
+        """
         if not raw_params.get("points"):
             return None
-        mask = np.zeros_like(raw)
-        return cv2.fillPoly(mask, [np.array(raw_params["points"])], 1)
+        mask = np.zeros(raw.shape[:2], dtype=np.uint8)
+        cv2.fillPoly(mask, [np.array(raw_params["points"])], 1)
+        return cv2.integral(mask)
+
+    @classmethod
+    def gen_roi(
+        cls, shape: Tuple[int, ...], points: List[List[int]], margin: float
+    ) -> Optional[Tuple[int, int, int, int]]:
+        """
+        mask 外接矩形向外扩展 margin 比例后的区域
+
+        :return: (x0, y0, x1, y1)，没有配置 mask 时返回 None
+        """
+        if not points:
+            return None
+        height, width = shape[:2]
+        x, y, w, h = cv2.boundingRect(np.array(points, dtype=np.int32))
+        dx, dy = int(w * margin), int(h * margin)
+        x0, y0 = max(x - dx, 0), max(y - dy, 0)
+        x1, y1 = min(x + w + dx, width), min(y + h + dy, height)
+        if x1 <= x0 or y1 <= y0:
+            return None
+        return x0, y0, x1, y1
+
+    @classmethod
+    def offset_detections(cls, detections: Tuple, x0: int, y0: int) -> Tuple:
+        dets, det_scores, det_labels = detections
+        dets = [
+            [int(xmin) + x0, int(ymin) + y0, int(xmax) + x0, int(ymax) + y0]
+            for xmin, ymin, xmax, ymax in dets
+        ]
+        return dets, det_scores, det_labels
 
     @classmethod
     def filter_objects(
         cls,
-        mask: np.ndarray,
+        integral: np.ndarray,
         objects: List[ObjectPayload],
         iou_thresh: float,
         slice_count: int,
     ):
-        filter_objects = []
-        for object in objects:
-            x1, y1, x2, y2 = object.box.x1, object.box.y1, object.box.x2, object.box.y2
-            # 取box下方1/4的区域
-            y_slice = y2 - (y2 - y1) // slice_count
-            box_in_mask = np.sum(mask[y_slice:y2, x1:x2])
-            box_area = (x2 - x1 + 1) * (y2 - y1 + 1)
-            if box_area > 0 and (box_in_mask / box_area) >= iou_thresh:
-                filter_objects.append(object)
-        return filter_objects
+        if not objects:
+            return []
+        height, width = integral.shape[0] - 1, integral.shape[1] - 1
+        boxes = np.array(
+            [[o.box.x1, o.box.y1, o.box.x2, o.box.y2] for o in objects], dtype=np.int64
+        )
+        x1, y1, x2, y2 = boxes.T
+        # 取box下方1/slice_count的区域, 与切片 mask[y_slice:y2, x1:x2] 的范围一致
+        y_slice = y2 - (y2 - y1) // slice_count
+        xa, xb = np.clip(x1, 0, width), np.clip(x2, 0, width)
+        ya, yb = np.clip(y_slice, 0, height), np.clip(y2, 0, height)
+        xb, yb = np.maximum(xa, xb), np.maximum(ya, yb)
+        box_in_mask = (
+            integral[yb, xb] - integral[ya, xb] - integral[yb, xa] + integral[ya, xa]
+        )
+        box_area = (x2 - x1 + 1) * (y2 - y1 + 1)
+        keep = (box_area > 0) & (box_in_mask >= iou_thresh * box_area)
+        return [obj for obj, k in zip(objects, keep) if k]
 
 
 if __name__ == "__main__":
@@ -61,6 +61,11 @@ class DetectionParamsModel(ModelParamsModel):
     class_names: List[str] = ["person"]
     nms_thresh: float = 0.6
     confidence_thresh: float = 0.4
+    batch_size: int = Field(
+        default=1,
+        description="多摄像头检测批大小, 不超过 worker 数量, 为 1 时不组批; 模型需支持动态 batch",
+    )
+    batch_wait_ms: float = Field(default=5, description="组批时单帧最多等待的毫秒数")
 
 
 class FeatureDBParamsModel(ModelParamsModel):
@@ -70,6 +75,42 @@ class FeatureDBParamsModel(ModelParamsModel):
     base_dir: str = "db/person"
     db_size: int = 1000
     sim_threshold: float = 0.9
+    index_type: str = Field(
+        default="flat",
+        description="特征库检索方式, flat 精确检索, ivf 倒排索引近似检索",
+    )
+    ivf_nprobe: int = Field(default=8, description="ivf 检索时比较的桶数量")
+    ivf_min_train_size: int = Field(
+        default=5000,
+        description="特征库数量达到该值后才训练 ivf 索引, 之前使用精确检索",
+    )
+    batch_size: int = Field(
+        default=32,
+        description="特征提取单次推理的最大人物数量, 模型不支持动态 batch 时自动逐张推理",
+    )
+    storage_type: str = Field(
+        default="files",
+        description="特征库存储方式, files 每个样本单独保存特征文件, mmap 所有特征保存在一个矩阵文件中, 切换前使用 migrate_featuredb.py 迁移",
+    )
+    evict_policy: str = Field(
+        default="none",
+        description="特征库达到 db_size 后的处理方式, none 不再添加, lru 删除最久未匹配的样本, least_matched 删除匹配次数最少的样本",
+    )
+    max_age_days: float = Field(
+        default=0, description="超过该天数未匹配的样本自动删除, 为 0 时不删除"
+    )
+    merge_threshold: float = Field(
+        default=0,
+        description="新样本与已有样本相似度不低于该值时合并到已有样本, 为 0 时不合并, 应高于 sim_threshold",
+    )
+    precision: str = Field(
+        default="float32",
+        description="内存中特征的存储精度, float32, float16 或 int8(每个特征一个缩放系数), 见 benchmark_precision.py",
+    )
+    write_queue_size: int = Field(
+        default=256,
+        description="记录模式下等待写盘的最大样本数量, 超过时新样本只保存在内存中, 重启后丢失, 为 0 时同步写盘",
+    )
 
     @property
     def db_path(self):
@@ -79,6 +120,23 @@ class FeatureDBParamsModel(ModelParamsModel):
         return _dir
 
 
+class TrackerParamsModel(BaseModel):
+    enable: bool = Field(
+        default=False,
+        description="是否开启人物跟踪, 开启后复用同一人物的特征库比较结果",
+    )
+    iou_threshold: float = Field(
+        default=0.3, description="检测框与跟踪预测框匹配的最小IoU"
+    )
+    max_age: int = Field(default=30, description="跟踪连续未匹配多少帧后删除")
+    recheck_interval: int = Field(
+        default=25, description="同一人物每隔多少帧重新提取特征比较"
+    )
+    recheck_iou: float = Field(
+        default=0.7, description="人物框与上次比较时的IoU低于该值时重新提取特征比较"
+    )
+
+
 class AIboxPersonParamsModel(BaseParamsModel):
     detection: DetectionParamsModel = DetectionParamsModel(
         weight_name="yolov8s-crowd_and_mot"
@@ -91,6 +149,13 @@ class AIboxPersonParamsModel(BaseParamsModel):
         default=False, description="是否记录当前获取的图像信息和特征"
     )
     box_slice_count: int = Field(default=8, description="BOX框高度的切片数")
+    roi_crop: bool = Field(
+        default=False, description="配置mask时只检测mask外接矩形区域"
+    )
+    roi_margin: float = Field(
+        default=0.1, description="检测区域在mask外接矩形基础上向外扩展的比例"
+    )
+    tracker: TrackerParamsModel = TrackerParamsModel()
 
 
 ## ======= Web Schema ======= ##
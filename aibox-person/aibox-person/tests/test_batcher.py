@@ -0,0 +1,72 @@
+import threading
+
+import numpy as np
+
+from algrothms.batcher import DetectionBatcher, detect_by_shape
+
+INPUT_W, INPUT_H = 640, 480
+
+
+def fake_predict(images):
+    """
+    模拟 metacv Detection.predict: 每张画面按自己的比例缩放后检测,
+    但还原检测框时统一使用第一张画面的缩放比例
+    """
+    ratios = [min(INPUT_W / img.shape[1], INPUT_H / img.shape[0]) for img in images]
+    dets, scores, labels = [], [], []
+    for img, ratio in zip(images, ratios):
+        h, w = img.shape[:2]
+        # 模型输入坐标系中的检测框: 画面中心区域
+        box = np.array([w / 4, h / 4, w * 3 / 4, h * 3 / 4]) * ratio
+        dets.append([(box / ratios[0]).astype(int).tolist()])
+        scores.append([0.9])
+        labels.append([0])
+    return dets, scores, labels
+
+
+class FakeModel:
+    def detect(self, images):
+        return detect_by_shape(fake_predict, images)
+
+
+def make_frames():
+    return [
+        np.zeros((720, 1280, 3), np.uint8),
+        np.zeros((480, 640, 3), np.uint8),
+        np.zeros((300, 500, 3), np.uint8),
+        np.zeros((720, 1280, 3), np.uint8),
+    ]
+
+
+def test_fake_predict_mixes_ratios():
+    # 确认模拟的模型在混合尺寸时会得到错误的检测框
+    frames = make_frames()
+    single = [fake_predict([frame])[0][0] for frame in frames]
+    mixed = fake_predict(frames)[0]
+    assert mixed != single
+
+
+def test_detect_by_shape_matches_single_frame():
+    frames = make_frames()
+    single = [FakeModel().detect([frame])[0] for frame in frames]
+    assert FakeModel().detect(frames) == single
+
+
+def test_batched_detection_matches_single_frame():
+    frames = make_frames()
+    expected = [FakeModel().detect([frame])[0] for frame in frames]
+    batcher = DetectionBatcher(batch_size=len(frames), max_wait_ms=200)
+    results = [None] * len(frames)
+
+    def worker(idx):
+        results[idx] = batcher.detect(FakeModel(), frames[idx])
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(frames))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert results == expected
+    assert batcher.stats()["frames"] == len(frames)
+    assert batcher.stats()["batches"] < len(frames)
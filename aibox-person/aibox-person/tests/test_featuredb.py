@@ -0,0 +1,77 @@
+import os
+
+import numpy as np
+
+from algrothms import featuredb
+from algrothms.featuredb import FeatureData, FeatureDB
+
+DIM = 512
+
+
+class SingleInputModel:
+    """只支持单张输入的模型: 无论输入多少张图像都只返回第一张的特征"""
+
+    def __init__(self, **kwargs) -> None:
+        pass
+
+    def feature(self, images):
+        return np.full((1, DIM), float(images[0].mean()), np.float32)
+
+
+class FakeMeta:
+    Classification = SingleInputModel
+
+
+def test_features_fallback_when_model_returns_one_row(monkeypatch):
+    monkeypatch.setattr(featuredb, "get_import_meta", lambda model_type: FakeMeta)
+    db = FeatureDB(8, 8, "", "onnx", 0, db_instance=None, batch_size=32)
+    images = [np.full((8, 8, 3), value, np.uint8) for value in (1, 2, 3, 4)]
+
+    features = db.features(images)
+
+    assert features.shape == (4, DIM)
+    np.testing.assert_allclose(features[:, 0], [1, 2, 3, 4])
+    assert not db._batch_supported
+
+
+def test_close_writes_queued_samples(tmp_path):
+    db = FeatureData({}, str(tmp_path), db_size_threshold=100, write_queue_size=256)
+    image = np.zeros((4, 4, 3), np.uint8)
+    for key in range(10):
+        db.add(str(key), image, np.ones(8, np.float32))
+    db.close()
+
+    storage = db.storage
+    assert all(os.path.exists(storage.feature_file(str(key))) for key in range(10))
+    assert db.writer.stats()["written"] == 10
+
+
+def test_default_policy_refuses_instead_of_evicting(tmp_path):
+    db = FeatureData({}, str(tmp_path), db_size_threshold=3, write_queue_size=0)
+    image = np.zeros((4, 4, 3), np.uint8)
+    rng = np.random.default_rng(0)
+    sizes = []
+    for key in range(1000000, 1000006):
+        db.add(str(key), image, rng.standard_normal(8).astype(np.float32))
+        sizes.append(db.size)
+
+    # 与原来一致: 数量超过 db_size_threshold 后不再添加
+    assert sizes == [1, 2, 3, 4, 4, 4]
+    assert db.evicted == 0
+    for key in range(1000000, 1000004):
+        assert os.path.exists(db.storage.feature_file(str(key)))
+        assert str(key) in db.keys
+
+
+def test_lru_policy_keeps_size_at_threshold(tmp_path):
+    db = FeatureData(
+        {}, str(tmp_path), db_size_threshold=3, write_queue_size=0, evict_policy="lru"
+    )
+    image = np.zeros((4, 4, 3), np.uint8)
+    rng = np.random.default_rng(0)
+    for key in range(1000000, 1000006):
+        db.add(str(key), image, rng.standard_normal(8).astype(np.float32))
+
+    assert db.size == 3
+    assert db.evicted == 3
+    assert not os.path.exists(db.storage.feature_file("1000000"))
@@ -0,0 +1,102 @@
+import sys
+import threading
+import time
+
+import numpy as np
+
+from algrothms.featuredb import FeatureData
+
+DIM = 32
+
+
+def random_features(rng, n):
+    return rng.standard_normal((n, DIM)).astype(np.float32)
+
+
+def check_ivf(db: FeatureData) -> None:
+    """每行恰好在一个桶中出现一次, 位置映射与桶一致, 桶中的特征与特征矩阵一致"""
+    index = db.index
+    matrix = db.matrix
+    seen = np.zeros(db.size, dtype=int)
+    for idx, lst in enumerate(index.lists):
+        ids = lst.ids[: lst.count]
+        assert (ids < db.size).all()
+        np.add.at(seen, ids, 1)
+        for pos, row in enumerate(ids):
+            assert index.loc_list[row] == idx
+            assert index.loc_pos[row] == pos
+        np.testing.assert_allclose(lst.vecs[: lst.count], matrix[ids], atol=1e-6)
+    assert (seen == 1).all()
+
+
+def create_db(tmp_path, rng, size: int = 2000) -> FeatureData:
+    features = random_features(rng, size)
+    data = {str(i): feature for i, feature in enumerate(features)}
+    return FeatureData(
+        data,
+        str(tmp_path),
+        db_size_threshold=100000,
+        index_type="ivf",
+        index_params={"nlist": 16, "min_train_size": 100, "iterations": 2},
+        write_queue_size=0,
+    )
+
+
+def test_rebuild_between_remove_and_move(tmp_path):
+    """删除时在 index.remove 与 index.move 之间开始重建, 重建需等待删除完成"""
+    rng = np.random.default_rng(0)
+    db = create_db(tmp_path, rng)
+    index = db.index
+    remove = index.remove
+    rebuilds = []
+
+    def remove_then_rebuild(row):
+        remove(row)
+        thread = threading.Thread(
+            target=index._swap, args=(index.centroids, index.trained_size)
+        )
+        thread.start()
+        thread.join(0.05)
+        rebuilds.append(thread)
+
+    index.remove = remove_then_rebuild
+    for key in db.keys[:20]:
+        db.delete(key)
+    for thread in rebuilds:
+        thread.join()
+    assert db.size == 1980
+    check_ivf(db)
+
+
+def test_concurrent_delete_during_retrain(tmp_path):
+    rng = np.random.default_rng(0)
+    db = create_db(tmp_path, rng)
+    check_ivf(db)
+
+    stop = threading.Event()
+
+    def retrain():
+        while not stop.is_set():
+            db.index.train()
+
+    # 频繁切换线程, 让重建与删除交错执行
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    thread = threading.Thread(target=retrain)
+    thread.start()
+    try:
+        image = np.zeros((4, 4, 3), np.uint8)
+        next_key = db.size
+        for _ in range(1500):
+            keys = db.keys
+            db.delete(keys[rng.integers(len(keys))])
+            db.add(str(next_key), image, random_features(rng, 1)[0])
+            next_key += 1
+    finally:
+        stop.set()
+        thread.join()
+        sys.setswitchinterval(interval)
+    # 等待添加时触发的后台训练结束
+    while db.index._training:
+        time.sleep(0.01)
+    check_ivf(db)
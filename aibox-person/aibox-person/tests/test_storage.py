@@ -0,0 +1,30 @@
+import numpy as np
+
+from algrothms.featuredb import FeatureData
+
+
+def load(db_path: str, precision: str = "float32") -> FeatureData:
+    return FeatureData.load(
+        db_path, 100, write_queue_size=0, storage_type="mmap", precision=precision
+    )
+
+
+def test_mmap_load_and_append(tmp_path):
+    rng = np.random.default_rng(0)
+    features = rng.standard_normal((20, 8)).astype(np.float32)
+    image = np.zeros((4, 4, 3), np.uint8)
+    db = load(str(tmp_path))
+    for key, feature in enumerate(features):
+        db.add(str(key), image, feature)
+
+    for precision in ("float32", "int8"):
+        db = load(str(tmp_path), precision)
+        # 加载时只读映射, 第一次写入时才以读写方式映射
+        assert db.storage._matrix.mode == "r"
+        expected = features / np.linalg.norm(features, axis=1, keepdims=True)
+        rows = [db.keys.index(str(key)) for key in range(len(features))]
+        np.testing.assert_allclose(db.matrix[rows], expected, atol=1e-2)
+
+    db.add("20", image, features[0])
+    assert db.storage._matrix.mode == "r+"
+    assert load(str(tmp_path)).size == 21
@@ -0,0 +1,42 @@
+import os
+import threading
+
+import numpy as np
+
+from algrothms.storage import FileStorage
+from algrothms.writer import FeatureWriter
+
+
+class BlockingStorage(FileStorage):
+    """release 之前保存任务一直阻塞, 使队列保持已满"""
+
+    def __init__(self, db_path: str) -> None:
+        super().__init__(db_path)
+        self.release = threading.Event()
+
+    def save(self, key, image, feature) -> None:
+        self.release.wait(5)
+        super().save(key, image, feature)
+
+
+def test_skip_follow_up_ops_of_dropped_save(tmp_path):
+    storage = BlockingStorage(str(tmp_path))
+    writer = FeatureWriter(storage, max_queue=1)
+    image = np.zeros((4, 4, 3), np.uint8)
+    feature = np.ones((1, 8), np.float32)
+
+    assert writer.save("1", image, feature)
+    assert not writer.save("2", image, feature)
+    writer.update("2", feature)
+    writer.delete("2")
+    storage.release.set()
+    assert writer.flush(5)
+    writer.close()
+
+    stats = writer.stats()
+    assert stats["written"] == 1
+    assert stats["dropped"] == 1
+    assert stats["skipped"] == 2
+    assert stats["failed"] == 0
+    assert os.path.exists(storage.image_file("1"))
+    assert not os.path.exists(storage.image_file("2"))
@@ -1,6 +1,8 @@
 import os
 import json
 from threading import Thread
+from collections import defaultdict
+from typing import Dict
 from urllib.parse import urljoin
 
 from fastapi.staticfiles import StaticFiles
@@ -17,6 +19,14 @@ from schema import RecordFeatureModel, WebNodeParams
 # 全局变量
 node_id = None
 contexts = {}
+# 检测批处理, 由节点设置
+batcher = None
+# 画面变化检测的跳帧统计, 摄像头ID -> {"frames": 总帧数, "skipped": 复用结果的帧数}
+motion_stats: Dict[str, Dict[str, int]] = defaultdict(
+    lambda: {"frames": 0, "skipped": 0}
+)
+# 各摄像头的人物跟踪器, 由节点设置
+trackers = {}
 
 
 """
@@ -143,6 +153,39 @@ def record_feature(item: RecordFeatureModel):
     return {"result": "success"}
 
 
+@router.get("/featuredb/index/stats")
+def get_index_stats():
+    inference: Inference = contexts[0]["context"]["model"]
+    return inference.featuredb.db_instance.index.stats()
+
+
+@router.get("/featuredb/stats")
+def get_featuredb_stats():
+    inference: Inference = contexts[0]["context"]["model"]
+    return inference.featuredb.db_instance.stats()
+
+
+@router.get("/featuredb/writer/stats")
+def get_writer_stats():
+    inference: Inference = contexts[0]["context"]["model"]
+    return inference.featuredb.db_instance.writer.stats()
+
+
+@router.get("/motion/stats")
+def get_motion_stats():
+    return motion_stats
+
+
+@router.get("/tracker/stats")
+def get_tracker_stats():
+    return {source_id: tracker.stats() for source_id, tracker in list(trackers.items())}
+
+
+@router.get("/detection/batch/stats")
+def get_batch_stats():
+    return batcher.stats() if batcher else {}
+
+
 @router.get("/config")
 def get_params():
     params = contexts[0]["params"]